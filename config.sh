@@ -85,6 +85,12 @@ HIGHLIGHT="8ball.sh"
 # in a private message context
 PRIVMSG_DEFAULT_CMD='help'
 
+# run python plugins in a long-lived py8ball host process
+# instead of starting a new interpreter for every event.
+# requires ncat to talk to the host's unix socket.
+# set to blank to disable
+PY_PLUGIN_HOST=yes
+
 # prefix that commands should start with
 CMD_PREFIX=".,!"
 declare -gA COMMANDS
@@ -117,8 +123,8 @@ COMMANDS=(
 ["urb"]="urbandict.sh"
 ["urban"]="urbandict.sh"
 ["bible"]="bible.py"
-# TODO: Implement later.
-#["quran"]="bible.sh"
+["quran"]="bible.py"
+["koran"]="bible.py"
 # currently broken
 #["fap"]="fap.sh"
 #["gay"]="fap.sh"
@@ -210,6 +216,10 @@ export PERSIST_LOC="/tmp"
 export PAGETITLE_IGNORE='
 #nopagetitle
 '
+# max number of links in a message pagetitle.py fetches titles for
+export PAGETITLE_MAX_URLS=3
+# max bytes of a page pagetitle.py reads looking for its title
+export PAGETITLE_MAX_BYTES=40960
 
 # newline separated channels to disable the
 # youtube regexp match mode
@@ -233,6 +243,13 @@ export MOOSE_OUTPUT_DELAY='0.3s'
 # in seconds or whatever timespec that the sleep command takes
 export MLB_POLL_RATE=90
 
+# seconds coingecko.py caches prices for
+export COINGECKO_CACHE_TTL=45
+
+# seconds a python plugin may take before replying "timed out".
+# can be set per plugin too, e.g. COINGECKO_TIMEOUT.
+export PY8BALL_TIMEOUT=15
+
 # the following are twitter consumer key and secret for the twitter plugin
 #export TWITTER_KEY=your-key-here
 #export TWITTER_SECRET=your-key-here
@@ -142,6 +142,9 @@ mkdir "$PLUGIN_TEMP" ||
 # this is for plugins, so export it
 export PLUGIN_TEMP
 
+# socket for the persistent python plugin host; see start_py_host
+PY_HOST_SOCKET="$PLUGIN_TEMP/py8ball-host.sock"
+
 #########
 # State #
 #########
@@ -182,6 +185,8 @@ quit_prg() {
     exec 4<&-
     [[ -n "$ncat_pid" ]] &&
         kill -- "$ncat_pid"
+    [[ -n "$py_host_pid" ]] &&
+        kill -- "$py_host_pid"
     rm -rf -- "$APP_TMP"
     exit "$exit_status"
 }
@@ -264,6 +269,9 @@ reload_config() {
     for ign in "${IGNORE[@]}"; do
         ignore_hash[$ign]=1
     done
+
+    # plugins, or their environment variables, may have changed.
+    start_py_host
 }
 trap 'reload_config' SIGHUP SIGWINCH
 
@@ -907,6 +915,96 @@ send_cmd() {
     done
 }
 
+# (Re)start the persistent python plugin host.
+# Every python plugin in COMMANDS, REGEX and HIGHLIGHT is imported once
+# by the host; see plugins/py8ball/host.py.
+# Talking to its Unix socket requires ncat.
+#
+# config: PY_PLUGIN_HOST - non-empty to enable the host.
+start_py_host() {
+    if [[ -n "$py_host_pid" ]]; then
+        kill -- "$py_host_pid"
+        wait "$py_host_pid"
+        py_host_pid=
+    fi
+    [[ -z "$PY_PLUGIN_HOST" ]] && return
+    if ! type ncat >/dev/null 2>&1; then
+        send_log 'WARNING' 'PY_PLUGIN_HOST requires ncat; python plugins will be run directly.'
+        return
+    fi
+
+    local plugin
+    local -A py_plugins=()
+    for plugin in "${COMMANDS[@]}" "${REGEX[@]}" "$HIGHLIGHT"; do
+        [[ "$plugin" == *.py ]] && py_plugins[$plugin]=1
+    done
+    (( ${#py_plugins[@]} == 0 )) && return
+
+    PYTHONPATH="$PLUGIN_PATH${PYTHONPATH:+":$PYTHONPATH"}" \
+        python3 -m py8ball.host \
+            "$PY_HOST_SOCKET" "$PLUGIN_PATH" "${!py_plugins[@]}" \
+            > >(send_cmd) &
+    py_host_pid=$!
+}
+
+# Check that the python plugin host is running and listening.
+#
+# mutates: py_host_pid - cleared if the host has exited.
+# returns:             - 0 if plugins can be sent to the host.
+py_host_alive() {
+    [[ -n "$py_host_pid" ]] || return 1
+    if ! kill -0 "$py_host_pid" 2>/dev/null; then
+        send_log 'WARNING' 'The python plugin host exited; python plugins will be run directly.'
+        py_host_pid=
+        return 1
+    fi
+    [[ -S "$PY_HOST_SOCKET" ]]
+}
+
+# Seconds to wait for a hosted python plugin before giving up on it:
+# its time budget (see plugins/py8ball/deadline.py) plus a grace period,
+# like the hard kill of plugins which are run directly.
+#
+# $1      - path to the plugin
+# mutates: REPLY - the seconds.
+py_plugin_timeout() {
+    local name="${1##*/}"
+    name="${name%.py}"
+    name="${name^^}_TIMEOUT"
+    name="${name//[^A-Z0-9_]/_}"
+    local budget="${!name:-${PY8BALL_TIMEOUT:-15}}"
+    # whole seconds of e.g. 2.5
+    budget="${budget%%.*}"
+    [[ "$budget" =~ ^[0-9]+$ ]] || budget=15
+    REPLY="$(( budget + 5 ))"
+}
+
+# Run a plugin with the arguments created by build_cmdline.
+# Python plugins are sent to the plugin host when it is ready,
+# and run directly if it cannot be reached.
+#
+# $1 - path to the plugin
+# $2 - the user/channel to reply to; see send_cmd.
+run_plugin() {
+    if [[ "$1" == *.py ]] && py_host_alive; then
+        py_plugin_timeout "$1"
+        local timeout="$REPLY"
+        {
+            {
+                printf '%s\0' "${1##*/}" "${AREPLY[@]}"
+                printf '\0'
+            } | timeout -k 1 "$timeout" ncat -U "$PY_HOST_SOCKET"
+            # 124 and 137 are timeouts, anything else a failed connection.
+            case "$?" in
+                0|124|137) ;;
+                *) "$1" "${AREPLY[@]}" ;;
+            esac
+        } | send_cmd "$2" &
+    else
+        "$1" "${AREPLY[@]}" | send_cmd "$2" &
+    fi
+}
+
 # Match a string to the list of configured regexps to check.
 #
 # $1             - String to try and match.
@@ -1170,7 +1268,7 @@ handle_privmsg() {
         if [[ -x "$cmd_path" ]]; then
             send_log "DEBUG" "PRIVATE COMMAND EVENT -> $cmd: $user <$user> $umsg"
             build_cmdline command "$cmd"
-            "$cmd_path" "${AREPLY[@]}" | send_cmd "$user" &
+            run_plugin "$cmd_path" "$user"
         else
             send_log "ERROR" "PRIVATE COMMAND NOEXEC -> Make sure $cmd_path exists or is executable"
         fi
@@ -1186,7 +1284,7 @@ handle_privmsg() {
         if [[ -x "$cmd_path" ]]; then
             send_log "DEBUG" "HIGHLIGHT EVENT -> $channel <$user>  $umsg"
             build_cmdline command "$cmd"
-            "$cmd_path" "${AREPLY[@]}" | send_cmd "$channel" &
+            run_plugin "$cmd_path" "$channel"
             return
         else
             send_log 'ERROR' "HIGHLIGHT NOEXEC -> Make sure $cmd_path exists or is executable"
@@ -1204,7 +1302,7 @@ handle_privmsg() {
             check_spam "$user" || return
             send_log "DEBUG" "COMMAND EVENT -> $cmd: $channel <$user> $umsg"
             build_cmdline command "$cmd"
-            "$cmd_path" "${AREPLY[@]}" | send_cmd "$channel" &
+            run_plugin "$cmd_path" "$channel"
             return
         else
             send_log 'ERROR' "COMMAND NOEXEC -> Make sure $cmd_path exists or is executable"
@@ -1221,7 +1319,7 @@ handle_privmsg() {
         if [[ -x "$cmd_path" ]]; then
             send_log "DEBUG" "REGEX EVENT -> $regex: $channel <$user> $message (${BASH_REMATCH[0]})"
             build_cmdline regexp "$regex" "${BASH_REMATCH[0]}"
-            "$cmd_path" "${AREPLY[@]}" | send_cmd "$channel" &
+            run_plugin "$cmd_path" "$channel"
             return
         else
             send_log 'ERROR' "REGEX NOEXEC -> Make sure $cmd_path exists or is executable"
@@ -1249,6 +1347,8 @@ fi
 # "Ident" information
 send_msg "NICK $NICK"
 send_msg "USER $NICK +i * :$NICK"
+# plugins are ready by the time we have joined channels
+start_py_host
 # IRC event loop
 # note if the irc sends lines longer than
 # 1024 bytes, it may fail to parse
@@ -16,125 +16,486 @@
 import sqlite3
 import re
 
-from typing import TextIO, Union
+from fcntl import flock, LOCK_EX
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+from os import getpid, replace
 from pathlib import Path
 from io import StringIO
+from sys import argv
 
 from py8ball import main_decorator
 from py8ball.sqlite3_helpers import Sqlite3Manager, escape_fts5
-from py8ball.logging import log_e
+from py8ball.logging import log_e, log_w
 from py8ball.environment import get_persistant_location
 from py8ball.http_helpers import paste_service
 
 
 try:
-    BIBLE_DB_PATH = get_persistant_location() / 'bible-plugin.db'
-    BIBLE_DB = Sqlite3Manager(BIBLE_DB_PATH)
+    DATA_DIR = get_persistant_location()
 except KeyError:
     log_e('$PERSIST_LOC or $XDG_DATA_HOME are not defined.')
     exit(1)
 
+# The database is built from the texts in static/, either ahead of time
+# with `bible.py --build-db` or by the first invocation that needs it,
+# and only ever read afterwards.
+BIBLE_DB_PATH = DATA_DIR / 'bible-plugin.db'
+BIBLE_DB = Sqlite3Manager(BIBLE_DB_PATH, read_only=True)
+BIBLE_LOCK_PATH = DATA_DIR / 'bible-plugin.lock'
+# Bump when the schema changes, so old databases are rebuilt.
+BIBLE_DB_VERSION = 4
+BUILD_FLAG = '--build-db'
+STATIC_DIR = Path(__file__).parent / '..' / 'static'
 
-def read_bible_txt(cursor: sqlite3.Cursor,
-                   the_good_book: str,
-                   f: TextIO):
-    """Populate the database with text from a bible."""
-    lineno = 1
-    for line in f:
+# Longest passage a reference returns.
+MAX_VERSES = 200
+# `Book 1:2` or `1.2` labels of the verses in the texts.
+LABEL_RE = re.compile(r'(?:(.+?)\s+)?(\d+)[:.](\d+)')
+# References like `Jn 3:16`, `John 3:16-18`, `Jn 3:16-4:2`, `John 3`,
+# `John 3-4` or, in a corpus with a single book, `2:255`.
+REFERENCE_RE = re.compile(r'(?P<book>.*?)\s*(?P<c1>\d{1,3})'
+                          r'(?:[:.](?P<v1>\d{1,3}))?'
+                          r'(?:\s*-\s*(?:(?P<c2>\d{1,3})[:.])?'
+                          r'(?P<v2>\d{1,3}))?')
+
+# Abbreviations of the books, besides their names, as used by book_alias();
+# books are matched by their name in the bible text.
+BOOK_ABBREVIATIONS = {
+    'Genesis': ('gen', 'ge', 'gn'),
+    'Exodus': ('exod', 'exo', 'ex'),
+    'Leviticus': ('lev', 'le', 'lv'),
+    'Numbers': ('num', 'nu', 'nm', 'nb'),
+    'Deuteronomy': ('deut', 'de', 'dt'),
+    'Joshua': ('josh', 'jos', 'jsh'),
+    'Judges': ('judg', 'jdg', 'jg', 'jdgs'),
+    'Ruth': ('rth', 'ru'),
+    '1 Samuel': ('1sam', '1sa', '1sm'),
+    '2 Samuel': ('2sam', '2sa', '2sm'),
+    '1 Kings': ('1kgs', '1ki', '1kin', '1kg'),
+    '2 Kings': ('2kgs', '2ki', '2kin', '2kg'),
+    '1 Chronicles': ('1chron', '1chr', '1ch'),
+    '2 Chronicles': ('2chron', '2chr', '2ch'),
+    'Ezra': ('ezr',),
+    'Nehemiah': ('neh', 'ne'),
+    'Esther': ('esth', 'est', 'es'),
+    'Job': ('jb',),
+    'Psalms': ('ps', 'psa', 'psalm', 'pss', 'psm'),
+    'Proverbs': ('prov', 'pro', 'prv', 'pr'),
+    'Ecclesiastes': ('eccl', 'eccles', 'ecc', 'ec', 'qoh'),
+    'Song of Solomon': ('song', 'songofsongs', 'sos', 'so', 'sg'),
+    'Isaiah': ('isa', 'is'),
+    'Jeremiah': ('jer', 'je', 'jr'),
+    'Lamentations': ('lam', 'la'),
+    'Ezekiel': ('ezek', 'eze', 'ezk'),
+    'Daniel': ('dan', 'da', 'dn'),
+    'Hosea': ('hos', 'ho'),
+    'Joel': ('jl',),
+    'Amos': ('am',),
+    'Obadiah': ('obad', 'ob'),
+    'Jonah': ('jnh', 'jon'),
+    'Micah': ('mic', 'mc'),
+    'Nahum': ('nah', 'na'),
+    'Habakkuk': ('hab', 'hb'),
+    'Zephaniah': ('zeph', 'zep', 'zp'),
+    'Haggai': ('hag', 'hg'),
+    'Zechariah': ('zech', 'zec', 'zc'),
+    'Malachi': ('mal', 'ml'),
+    'Matthew': ('matt', 'mat', 'mt'),
+    'Mark': ('mrk', 'mar', 'mk', 'mr'),
+    'Luke': ('luk', 'lk'),
+    'John': ('joh', 'jhn', 'jn'),
+    'Acts': ('act', 'ac'),
+    'Romans': ('rom', 'ro', 'rm'),
+    '1 Corinthians': ('1cor', '1co'),
+    '2 Corinthians': ('2cor', '2co'),
+    'Galatians': ('gal', 'ga'),
+    'Ephesians': ('eph', 'ephes'),
+    'Philippians': ('phil', 'php', 'pp'),
+    'Colossians': ('col',),
+    '1 Thessalonians': ('1thess', '1thes', '1th'),
+    '2 Thessalonians': ('2thess', '2thes', '2th'),
+    '1 Timothy': ('1tim', '1ti'),
+    '2 Timothy': ('2tim', '2ti'),
+    'Titus': ('tit',),
+    'Philemon': ('philem', 'phm', 'pm'),
+    'Hebrews': ('heb',),
+    'James': ('jas', 'jm'),
+    '1 Peter': ('1pet', '1pe', '1pt', '1p'),
+    '2 Peter': ('2pet', '2pe', '2pt', '2p'),
+    '1 John': ('1jn', '1jhn', '1jo'),
+    '2 John': ('2jn', '2jhn', '2jo'),
+    '3 John': ('3jn', '3jhn', '3jo'),
+    'Jude': ('jud', 'jd'),
+    'Revelation': ('rev', 're', 'revelations'),
+}
+
+
+class Corpus(NamedTuple):
+    """A text which can be quoted and searched."""
+
+    name: str
+    # File in static/ with a `label | verse` line per verse.
+    text: str
+    # Book of the verses labeled with only a chapter and verse, if any.
+    book: Optional[str]
+    # Abbreviations of the books, by name.
+    abbreviations: dict[str, tuple[str, ...]]
+
+
+# Every corpus shares the tables and the full-text index of the database;
+# each one is a contiguous range of bids, in this order.
+CORPORA = (
+    Corpus('bible', 'king-james.txt', None, BOOK_ABBREVIATIONS),
+    # the empty alias lets `2:255` name the only book.
+    Corpus('quran', 'quran-allah-ver.txt', 'Quran',
+           {'Quran': ('koran', "qur'an", '')}),
+)
+# Corpus of the commands which are not named like one.
+COMMAND_CORPORA = {
+    'koran': 'quran',
+}
+
+
+def read_bible_txt(f: TextIO) -> Iterator[tuple[int, str, str]]:
+    """
+    Parse the text of a bible.
+
+    Args:
+        f: File with a `book | verse` line per verse.
+
+    Returns:
+        Iterator of (bid, book, verse) rows.
+    """
+    for lineno, line in enumerate(f, 1):
         book, verse = line.split('|', maxsplit=1)
-        book = book.strip()
-        verse = verse.strip()
-        cursor.execute(f'INSERT INTO {the_good_book}'
-                       '(bid, book, verse) VALUES (?, ?, ?)',
-                       (lineno, book, verse))
-        cursor.execute(f'INSERT INTO {the_good_book+"_verse"}'
-                       '(vid, verse_text) VALUES (?, ?)',
-                       (lineno, verse,))
-        lineno += 1
-
-
-def populate_db(cursor: sqlite3.Cursor):
-    """Load the king james bible text into the db."""
-    statics = Path(__file__).parent / '..' / 'static'
-    kjb = statics / 'king-james.txt'
-    with kjb.open('r') as f:
-        read_bible_txt(cursor, 'king_james', f)
-    # quran = statics / 'quran-allah-ver.txt'
-    # with quran.open('r') as f:
-    #     read_bible_txt(cursor, 'quran', f)
-
-
-# sqlite3 already comes with a full-text search engine ootb.
+        yield lineno, book.strip(), verse.strip()
+
+
+def book_alias(name: str) -> str:
+    """Normalize a book name or abbreviation, e.g. `1 Jn.` to `1jn`."""
+    return re.sub(r'[\s.]', '', name.lower())
+
+
+def index_rows(corpus: Corpus,
+               rows: Iterable[tuple[int, str, str]],
+               bid: int,
+               book_id: int
+               ) -> tuple[list[tuple[int, str, str, int, int, int]],
+                          dict[str, int]]:
+    """
+    Give every verse an integer (book_id, chapter, verse_no) reference.
+
+    Verses are numbered from bid on, without gaps; repeated references
+    are skipped.
+
+    Args:
+        corpus: The corpus of the verses.
+        rows: The (bid, book, verse) rows of read_bible_txt().
+        bid: The bid of its first verse.
+        book_id: The book_id of its first book.
+
+    Returns:
+        (bid, book, verse, book_id, chapter, verse_no) rows, and a dict of
+        book names to their book_id, numbered in order of appearance.
+
+    Raises:
+        ValueError if a verse is not labeled like `Book 1:2`.
+    """
+    books = {}
+    seen = set()
+    ret = []
+    for _, label, verse in rows:
+        match = LABEL_RE.fullmatch(label)
+        if match is None or (match[1] or corpus.book) is None:
+            raise ValueError(f'Unexpected verse label: {label}')
+        name, chapter, verse_no = match.groups()
+        book = books.setdefault(name or corpus.book, book_id + len(books))
+        ref = (book, int(chapter), int(verse_no))
+        if ref in seen:
+            continue
+        seen.add(ref)
+        ret.append((bid + len(ret), label, verse, *ref))
+    return ret, books
+
+
+def book_aliases(corpus: Corpus, books: dict[str, int]) -> dict[str, int]:
+    """
+    List the names and abbreviations of the books of a corpus.
+
+    Args:
+        corpus: The corpus.
+        books: Its book names and their book_id, from index_rows().
+
+    Returns:
+        The book_id of every alias, as normalized by book_alias().
+    """
+    aliases = {}
+    for name, book_id in books.items():
+        aliases.setdefault(book_alias(name), book_id)
+    for name, abbreviations in corpus.abbreviations.items():
+        if book_alias(name) in aliases:
+            for abbreviation in abbreviations:
+                aliases.setdefault(abbreviation,
+                                   aliases[book_alias(name)])
+    return aliases
+
+
+def build_db(path: Path):
+    """
+    Build a new bible database.
+
+    The verses of every corpus are loaded in a single transaction, then the
+    full-text index is built once, optimized and the file vacuumed, as it is
+    only read from. Corpora without their text in static/ are left out.
+
+    Args:
+        path: Where to create the database.
+
+    Raises:
+        ValueError if a text is malformed.
+    """
+    corpora = []
+    books = []
+    aliases = []
+    rows = []
+    for corpus_id, corpus in enumerate(CORPORA, 1):
+        try:
+            with (STATIC_DIR / corpus.text).open('r') as f:
+                verses, names = index_rows(
+                    corpus,
+                    read_bible_txt(f),
+                    len(rows) + 1,
+                    len(books) + 1)
+        except OSError as e:
+            log_w(f'Skipping {corpus.name}: {e}')
+            continue
+        if not verses:
+            continue
+        corpora.append((corpus_id, corpus.name, verses[0][0], verses[-1][0]))
+        books.extend((book_id, corpus_id, name)
+                     for name, book_id in names.items())
+        aliases.extend((corpus_id, alias, book_id)
+                       for alias, book_id in book_aliases(corpus,
+                                                          names).items())
+        rows.extend(verses)
+
+    path.unlink(missing_ok=True)
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            cur = db.cursor()
+            cur.execute("""
+            CREATE TABLE corpora (
+                corpus_id INTEGER PRIMARY KEY NOT NULL,
+                name      TEXT UNIQUE NOT NULL,
+                first_bid INTEGER NOT NULL,
+                last_bid  INTEGER NOT NULL
+            );
+            """)
+            cur.execute("""
+            CREATE TABLE books (
+                book_id   INTEGER PRIMARY KEY NOT NULL,
+                corpus_id INTEGER NOT NULL REFERENCES corpora (corpus_id),
+                name      TEXT NOT NULL
+            );
+            """)
+            cur.execute("""
+            CREATE TABLE book_aliases (
+                corpus_id INTEGER NOT NULL REFERENCES corpora (corpus_id),
+                alias     TEXT NOT NULL,
+                book_id   INTEGER NOT NULL REFERENCES books (book_id),
+                PRIMARY KEY (corpus_id, alias)
+            ) WITHOUT ROWID;
+            """)
+            # bid is the rowid, which the full-text index refers to.
+            cur.execute("""
+            CREATE TABLE verses (
+                bid      INTEGER PRIMARY KEY NOT NULL,
+                book     TEXT NOT NULL,
+                verse    TEXT NOT NULL,
+                book_id  INTEGER NOT NULL REFERENCES books (book_id),
+                chapter  INTEGER NOT NULL,
+                verse_no INTEGER NOT NULL
+            );
+            """)
+            cur.execute("""
+            CREATE UNIQUE INDEX versesIdxRef
+            ON verses (book_id, chapter, verse_no);
+            """)
+            # sqlite3 already comes with a full-text search engine ootb.
+            # the index reads the verses from the verses table instead of
+            # storing a second copy of them.
+            cur.execute("""
+            CREATE VIRTUAL TABLE verses_fts USING fts5(
+                verse,
+                content = 'verses',
+                content_rowid = 'bid',
+                tokenize = 'porter'
+            );
+            """)
+            cur.executemany("""
+            INSERT INTO corpora (corpus_id, name, first_bid, last_bid)
+            VALUES (?, ?, ?, ?);
+            """, corpora)
+            cur.executemany("""
+            INSERT INTO books (book_id, corpus_id, name) VALUES (?, ?, ?);
+            """, books)
+            cur.executemany("""
+            INSERT INTO book_aliases (corpus_id, alias, book_id)
+            VALUES (?, ?, ?);
+            """, aliases)
+            cur.executemany("""
+            INSERT INTO verses
+            (bid, book, verse, book_id, chapter, verse_no)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """, rows)
+            cur.execute("""
+            INSERT INTO verses_fts (verses_fts) VALUES ('rebuild');
+            """)
+            cur.execute("""
+            INSERT INTO verses_fts (verses_fts) VALUES ('optimize');
+            """)
+            cur.execute(f'PRAGMA user_version = {BIBLE_DB_VERSION};')
+        db.execute('VACUUM;')
+    finally:
+        db.close()
+
+
+def db_version() -> Optional[int]:
+    """Get the schema version of the database, None if it is unusable."""
+    try:
+        with BIBLE_DB.connect() as db:
+            return db.execute('PRAGMA user_version;').fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def rebuild_db(force: bool = True):
+    """
+    Build the database and swap it in, one process at a time.
+
+    Args:
+        force: Rebuild even if the database is already up to date.
+
+    Raises:
+        OSError if the database is not writable.
+        ValueError if a text is malformed.
+        sqlite3.Error if the database could not be built.
+    """
+    with BIBLE_LOCK_PATH.open('a') as lock:
+        flock(lock, LOCK_EX)
+        # someone else may have built it while we waited.
+        if not force and db_version() == BIBLE_DB_VERSION:
+            return
+        tmp = BIBLE_DB_PATH.with_name(f'{BIBLE_DB_PATH.name}.{getpid()}.tmp')
+        try:
+            build_db(tmp)
+            # older versions kept the database in WAL mode.
+            for suffix in ('-wal', '-shm'):
+                Path(f'{BIBLE_DB_PATH}{suffix}').unlink(missing_ok=True)
+            replace(tmp, BIBLE_DB_PATH)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+
+def setup_db():
+    """Ensure an up to date database exists, building it if needed."""
+    if db_version() != BIBLE_DB_VERSION:
+        rebuild_db(force=False)
+
+
 @BIBLE_DB.apply
-def setup_db(*, db: sqlite3.Connection):
-    """Ensure the sqlite3 schema exists, populate the db."""
-    cur = db.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS king_james (
-        bid INTEGER PRIMARY KEY NOT NULL,
-        book TEXT NOT NULL,
-        verse TEXT NOT NULL
-    ) WITHOUT ROWID;
-    """)
-    cur.execute("""
-    CREATE INDEX IF NOT EXISTS king_jamesIdxBook
-    ON king_james (book);
-    """)
-    cur.execute("""
-    CREATE VIRTUAL TABLE IF NOT EXISTS king_james_verse USING fts5(
-        vid, verse_text, tokenize = 'porter'
-    )
-    """)
-    # populate if the table is empty
-    stmt = cur.execute("SELECT bid FROM king_james LIMIT 1")
-    row = stmt.fetchone()
-    if row is None:
-        populate_db(cur)
+def find_corpus(name: str, *,
+                db: sqlite3.Connection) -> Optional[tuple[int, int, int]]:
+    """
+    Find a corpus in the database.
+
+    Args:
+        name: The name of the corpus.
+
+    Returns:
+        Its corpus_id and first and last bid, None if it was not loaded.
+    """
+    return db.execute("""
+    SELECT corpus_id, first_bid, last_bid FROM corpora WHERE name = ?;
+    """, (name,)).fetchone()
 
 
 @BIBLE_DB.apply
-def find_by_book(book: str, count: int = -1, *,
-                 db: sqlite3.Connection) -> list[str]:
-    """Find by book + verse pair."""
-    cur = db.cursor()
-    stmt = cur.execute("""
-    SELECT bid, book, verse
-    FROM king_james
-    WHERE book = ?
-    """, (book,))
-    result_set = []
-    bid_to = -1
+def find_passage(corpus_id: int, reference: str, *,
+                 db: sqlite3.Connection) -> Optional[list[str]]:
+    """
+    Find the verses of a reference, like `Jn 3:16-4:2` or `John 3`.
 
-    row = stmt.fetchone()
-    if row is not None:
-        bid, bookv, verse = row
-        result_set.append(f'{bookv} | {verse}')
-        bid_to = bid + count
+    The reference is resolved to the first and last verse with the
+    (book_id, chapter, verse_no) index, then read as a single range of bids.
+
+    Args:
+        corpus_id: The corpus the books are from.
+        reference: The reference.
+
+    Returns:
+        Up to MAX_VERSES verses, with a note if there are more;
+        None if it is not a reference to a known book.
+    """
+    match = REFERENCE_RE.fullmatch(reference.strip())
+    if match is None:
+        return None
+    row = db.execute("""
+    SELECT book_id FROM book_aliases WHERE corpus_id = ? AND alias = ?;
+    """, (corpus_id, book_alias(match['book']))).fetchone()
+    if row is None:
+        return None
+    book_id = row[0]
+
+    c1 = int(match['c1'])
+    if match['v1'] is None:
+        # whole chapters: John 3 or John 3-4.
+        start = (c1, 0)
+        end = (int(match['v2'] or c1), 999)
     else:
-        return [f'No such verse: {book}']
+        start = (c1, int(match['v1']))
+        if match['v2'] is None:
+            end = start
+        else:
+            end = (int(match['c2'] or c1), int(match['v2']))
 
-    if bid_to != -1 and count != -1:
-        stmt = cur.execute("""
-        SELECT book, verse
-        FROM king_james
-        WHERE bid > ? AND bid < ?
-        """, (bid, bid_to))
-        for bookv, verse in stmt:
-            result_set.append(f'{bookv} | {verse}')
+    first = db.execute("""
+    SELECT bid FROM verses
+    WHERE book_id = ? AND (chapter, verse_no) >= (?, ?)
+    ORDER BY book_id, chapter, verse_no
+    LIMIT 1;
+    """, (book_id, *start)).fetchone()
+    last = db.execute("""
+    SELECT bid FROM verses
+    WHERE book_id = ? AND (chapter, verse_no) <= (?, ?)
+    ORDER BY book_id DESC, chapter DESC, verse_no DESC
+    LIMIT 1;
+    """, (book_id, *end)).fetchone()
+    if first is None or last is None:
+        return []
 
-    return result_set
+    verses = [f'{book} | {verse}' for book, verse in db.execute("""
+    SELECT book, verse FROM verses
+    WHERE bid BETWEEN ? AND ?
+    ORDER BY bid
+    LIMIT ?;
+    """, (first[0], last[0], MAX_VERSES + 1))]
+    if len(verses) > MAX_VERSES:
+        verses[MAX_VERSES:] = [f'... passages are limited to {MAX_VERSES} '
+                               'verses.']
+    return verses
 
 
 @BIBLE_DB.apply
-def random_verse(*, db: sqlite3.Connection) -> str:
-    """Fetch a random book + verse."""
+def random_verse(first_bid: int, last_bid: int, *,
+                 db: sqlite3.Connection) -> str:
+    """Fetch a random book + verse between two bids."""
     cur = db.cursor()
     stmt = cur.execute("""
-    SELECT book, verse FROM king_james
-    WHERE bid = (
-        (ABS(RANDOM())) % (SELECT max(bid) FROM king_james) + 1
-    )
-    """)
+    SELECT book, verse FROM verses
+    WHERE bid = (ABS(RANDOM())) % (? - ? + 1) + ?
+    """, (last_bid, first_bid, first_bid))
     row = stmt.fetchone()
     if row is not None:
         book, verse = row
@@ -144,19 +505,18 @@ def random_verse(*, db: sqlite3.Connection) -> str:
 
 
 @BIBLE_DB.apply
-def find_verse(query: str, *, db) -> str:
-    """Find a book + verse from a given query."""
+def find_verse(first_bid: int, last_bid: int, query: str, *, db) -> str:
+    """Find a book + verse between two bids from a given query."""
     cur = db.cursor()
     stmt = cur.execute("""
-    SELECT book, verse FROM king_james
-    INNER JOIN (
-        SELECT vid FROM king_james_verse
-        WHERE king_james_verse MATCH ?
+    SELECT book, verse FROM verses
+    WHERE bid = (
+        SELECT rowid FROM verses_fts
+        WHERE verses_fts MATCH ? AND rowid BETWEEN ? AND ?
         ORDER BY RANK
         LIMIT 1
     )
-    ON bid = vid
-    """, (escape_fts5(query),))
+    """, (escape_fts5(query), first_bid, last_bid))
     row = stmt.fetchone()
     if row is not None:
         book, verse = row
@@ -165,62 +525,51 @@ def find_verse(query: str, *, db) -> str:
         return f'No such verse containing: {query[0:15]}...'
 
 
-def parse_query(query: str) -> (Union[str, None], int):
-    """Parse a user provided query."""
-    like_book_verse = re.compile(r'\d{1,3}:\d{1,3}(?:-\d)?')
-    parts = query.split(' ')
-    if like_book_verse.fullmatch(parts[-1]):
-        bvc = parts[-1].split('-', maxsplit=1)
-        if len(bvc) == 2:
-            parts[-1] = bvc[0]
-            q = ' '.join(parts)
-            return q, int(bvc[1])
-        else:
-            return query, -1
-    else:
-        return None, -1
-
-
 @main_decorator
 def main(*,
+         command: str = 'bible',
          message: str = '') -> int:
     """Entrypoint."""
     try:
         setup_db()
-    except sqlite3.Error as e:
+    except (OSError, ValueError, sqlite3.Error) as e:
         print(':r Could not initialize bible; try again later.')
         log_e(str(e))
         return 1
-    # cmd = args.get(Flag.COMMAND, 'bible')
-    # if cmd == 'quran':
-    #     cmd = 'quran'
-    # else:
-    #     cmd = 'king_james'
+
+    name = COMMAND_CORPORA.get(command, command)
+    if name not in (corpus.name for corpus in CORPORA):
+        name = 'bible'
+    corpus = find_corpus(name)
+    if corpus is None:
+        print(f':r The {name} is not available.')
+        return 0
+    corpus_id, first_bid, last_bid = corpus
 
     if message == '':
-        print(f':r {random_verse()}')
+        print(f':r {random_verse(first_bid, last_bid)}')
+        return 0
+
+    res = find_passage(corpus_id, message)
+    if res is None:
+        print(f':r {find_verse(first_bid, last_bid, message)}')
+    elif len(res) == 0:
+        print(f':r No such verse: {message}')
+    elif len(res) == 1:
+        print(f':r {res[0]}')
     else:
-        query, count = parse_query(message)
-        if query is None:
-            print(f':r {find_verse(message)}')
-        elif count > 9:
-            print(':r Verse counts greater than 9 are currently unsupported.')
-        elif count < 1:
-            print(':r Verse counts must be greater than 0.')
-        else:
-            res = find_by_book(query, count)
-            if len(res) == 1:
-                print(f':r {res[0]}')
-            else:
-                try:
-                    url = paste_service(StringIO("\n".join(res)))
-                    print(f':r result: {url}')
-                except Exception as e:
-                    print(f': {res[0]}')
-                    log_e(str(e))
-                    return 1
+        try:
+            url = paste_service(StringIO('\n'.join(res)))
+            print(f':r result: {url}')
+        except Exception as e:
+            print(f':r {res[0]}')
+            log_e(str(e))
+            return 1
     return 0
 
 
 if __name__ == '__main__':
+    if argv[1:] == [BUILD_FLAG]:
+        rebuild_db()
+        exit(0)
     exit(main())
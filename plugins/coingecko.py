@@ -17,49 +17,163 @@
 
 # From Taigabot, with changes to work with neo8ball plus auto-updating code.
 
-from json import load as json_parse, JSONDecodeError, dump as json_dump
-from urllib.parse import quote
+import sqlite3
+
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_NB
+from io import StringIO
+from json import JSONDecodeError
+from os import environ, getpid, replace
+from pathlib import Path
+from subprocess import DEVNULL, Popen
+from sys import argv, executable
 from urllib.error import URLError, HTTPError
 from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
 
-from py8ball import main_decorator
-from py8ball.http_helpers import request_json
+from py8ball import LEN_LIMIT, main_decorator
+from py8ball.cache import Cache
+from py8ball.http_helpers import (paste_service, request_json,
+                                 request_json_stream)
 from py8ball.logging import log_e, log_i
-from py8ball.environment import get_persistant_location
+from py8ball.environment import get_persistant_location, get_temp_location
+from py8ball.sqlite3_helpers import Sqlite3Manager
 
 
 try:
     DATA_DIR = get_persistant_location()
-    DATA = DATA_DIR / 'cg-plugin.json'
+    COIN_DB_PATH = DATA_DIR / 'cg-plugin.db'
+    # The index is only ever replaced as a whole; see get_coin_list().
+    COIN_DB = Sqlite3Manager(COIN_DB_PATH, read_only=True)
+    COIN_LOCK_PATH = DATA_DIR / 'cg-plugin.lock'
 except KeyError:
     log_e('$PERSIST_LOC or $XDG_DATA_HOME are not defined.')
     exit(1)
 
+try:
+    PRICE_CACHE = Cache(get_temp_location() / 'cg-prices.db')
+except KeyError:
+    PRICE_CACHE = Cache(DATA_DIR / 'cg-prices.db')
+# Seconds market data is cached for.
+PRICE_CACHE_TTL = float(environ.get('COINGECKO_CACHE_TTL', 45))
+
+COIN_LIST_MAX_AGE = timedelta(weeks=1)
+# Run this plugin with only this argument to refresh the coin list.
+REFRESH_FLAG = '--refresh-coin-list'
+
 
-def get_coin_list() -> dict:
+def index_rows(coins: Iterable[dict]
+               ) -> Iterator[tuple[str, int, str, str, str]]:
+    """
+    Turn the coin list into rows of the lookup index.
+
+    Every coin is keyed by both its lowercased name and symbol.
+    pos keeps the order of the coin list, so the first match wins,
+    like it would scanning the list.
+
+    Args:
+        coins: The coins of the coins/list API response.
+
+    Returns:
+        Iterator of (key, pos, cid, symbol, name) rows.
+    """
+    for pos, coin in enumerate(coins):
+        cid = coin.get('id', '')
+        symbol = coin.get('symbol', '')
+        name = coin.get('name', '')
+        yield name.lower(), pos, cid, symbol, name
+        yield symbol, pos, cid, symbol, name
+
+
+def build_coin_index(coins: Iterable[dict], path: Path):
+    """
+    Build a new coin lookup index.
+
+    Args:
+        coins: The coins of the coins/list API response, which are
+               consumed as the index is built.
+        path: Where to create the index database.
+    """
+    path.unlink(missing_ok=True)
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            cur = db.cursor()
+            cur.execute("""
+            CREATE TABLE coin_index (
+                key    TEXT NOT NULL,
+                pos    INTEGER NOT NULL,
+                cid    TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                PRIMARY KEY(key, pos)
+            ) WITHOUT ROWID;
+            """)
+            cur.execute("""
+            CREATE TABLE coin_index_updated (
+                id      INTEGER PRIMARY KEY CHECK (id = 0),
+                updated REAL NOT NULL
+            );
+            """)
+            cur.executemany("""
+            INSERT OR IGNORE INTO coin_index (key, pos, cid, symbol, name)
+            VALUES (?, ?, ?, ?, ?);
+            """, index_rows(coins))
+            cur.execute("""
+            INSERT INTO coin_index_updated (id, updated) VALUES (0, ?);
+            """, (datetime.now().timestamp(),))
+    finally:
+        db.close()
+
+
+def get_coin_list() -> bool:
     """
     Get the latest list of coins that the coingecko ticker supports.
 
+    The list is stored as a lookup index keyed by name and symbol.
+    The new index is built in a temporary file and renamed over the old one,
+    so readers always see a complete index.
+
     Returns:
-        JSON response.
+        True if the index was updated.
     """
+    tmp = COIN_DB_PATH.with_name(f'{COIN_DB_PATH.name}.{getpid()}.tmp')
     try:
-        json = request_json('https://api.coingecko.com/api/v3/coins/list')
-        with DATA.open('w') as f:
-            json_dump(json, f)
-        return json
+        coins = request_json_stream(
+            'https://api.coingecko.com/api/v3/coins/list',
+            fields=('id', 'symbol', 'name'))
+        build_coin_index(coins, tmp)
+        # older versions kept the index in WAL mode.
+        for suffix in ('-wal', '-shm'):
+            Path(f'{COIN_DB_PATH}{suffix}').unlink(missing_ok=True)
+        replace(tmp, COIN_DB_PATH)
+        return True
     except JSONDecodeError:
         log_e('API Error: returned invalid JSON')
-        exit(1)
-    except FileNotFoundError as e:
-        log_e(f'File IO error: make sure {DATA} exists: {e}')
-        exit(1)
     except PermissionError as e:
         log_e(f'Make sure {DATA_DIR} is writable: {e}')
-        exit(1)
     except Exception as e:
         log_e(str(e))
-        exit(1)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return False
+
+
+def coin_list_updated() -> Optional[datetime]:
+    """
+    Get when the coin index was last updated.
+
+    Returns:
+        datetime of the last update, None if there is no usable index.
+    """
+    try:
+        with COIN_DB.connect() as db:
+            row = db.execute("""
+            SELECT updated FROM coin_index_updated WHERE id = 0;
+            """).fetchone()
+    except sqlite3.Error:
+        return None
+    return None if row is None else datetime.fromtimestamp(row[0])
 
 
 def check_coin_list_mtime() -> bool:
@@ -67,42 +181,85 @@ def check_coin_list_mtime() -> bool:
     Check if the coin list is up to date.
 
     Returns:
-        True if mtime is older than a week, false otherwise.
+        True if the coin list is missing or older than a week,
+        false otherwise.
     """
-    now = datetime.now()
-    week_ago = timedelta(weeks=1)
-    mtime = datetime.fromtimestamp(DATA.stat().st_mtime)
-    return mtime < now - week_ago
+    updated = coin_list_updated()
+    return updated is None or updated < datetime.now() - COIN_LIST_MAX_AGE
 
 
-try:
-    if check_coin_list_mtime():
-        log_i('Coin list is stale, getting newer list.')
-        COIN_LIST = get_coin_list()
-    else:
-        with DATA.open('r') as f:
-            COIN_LIST = json_parse(f)
-except FileNotFoundError:
-    COIN_LIST = get_coin_list()
-except JSONDecodeError:
-    COIN_LIST = get_coin_list()
-except Exception as e:
-    log_e(str(e))
-    exit(1)
+@contextmanager
+def refresh_lock(blocking: bool) -> Iterator[bool]:
+    """
+    Take the lock which guarantees only one coin list refresh runs.
+
+    Args:
+        blocking: wait for the lock instead of giving up.
+
+    Returns:
+        Context manager yielding True if the lock was taken.
+    """
+    with COIN_LOCK_PATH.open('a') as f:
+        try:
+            flock(f, LOCK_EX if blocking else LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+
+
+def refresh_coin_list(blocking: bool = False) -> bool:
+    """
+    Refresh the coin list if it is stale, unless a refresh is running.
 
+    Args:
+        blocking: wait for a running refresh instead of giving up.
 
-COIN_GECKO = 'https://api.coingecko.com/api/v3/coins/'
-QUERY = ('localization=false'
-         '&tickers=false'
-         '&market_data=true'
-         '&community_data=false'
-         '&developer_data=false'
-         '&sparkline=false')
+    Returns:
+        True if there is an up to date coin list.
+    """
+    with refresh_lock(blocking) as locked:
+        if not locked:
+            return False
+        # someone else may have just refreshed it.
+        if not check_coin_list_mtime():
+            return True
+        log_i('Coin list is stale, getting newer list.')
+        return get_coin_list()
 
 
-def find_coin_id(q: str) -> (str, str, str):
+def check_coin_list():
+    """
+    Make sure there is a coin list to search.
+
+    A stale list keeps being used while a single background process
+    refreshes it. Only a missing list is fetched while the user waits.
+    """
+    updated = coin_list_updated()
+    if updated is None:
+        refresh_coin_list(blocking=True)
+    elif updated < datetime.now() - COIN_LIST_MAX_AGE:
+        with refresh_lock(blocking=False) as locked:
+            if not locked:
+                return
+        Popen([executable, __file__, REFRESH_FLAG],
+              stdin=DEVNULL,
+              start_new_session=True)
+
+
+COIN_MARKETS = 'https://api.coingecko.com/api/v3/coins/markets'
+# change this to support other (real) coins like eur, jpy, gbp, nok
+REAL_COIN = 'usd'
+# Coins looked up per query. coins/markets takes up to 250 ids per page,
+# but beyond a couple dozen prices the reply is too long to be useful,
+# even as a paste.
+MAX_COINS = 25
+
+
+@COIN_DB.apply
+def find_coin_id(q: str, *, db: sqlite3.Connection) -> (str, str, str):
     """
-    Find the given coin by name or symbol from a list.
+    Find the given coin by name or symbol in the coin index.
 
     Args:
         q: the user provided coin to find.
@@ -112,90 +269,221 @@ def find_coin_id(q: str) -> (str, str, str):
 
     Raises:
         ValueError when coin is not found.
+        sqlite3.Error if the coin index is missing.
+    """
+    row = db.execute("""
+    SELECT cid, symbol, name FROM coin_index
+    WHERE key = ?
+    ORDER BY pos
+    LIMIT 1;
+    """, (q.lower(),)).fetchone()
+    if row is None:
+        raise ValueError(f"'{q}' is not in the coin list.")
+    return row
+
+
+def find_coins(q: str) -> (list[tuple[str, str, str]], list[str]):
+    """
+    Find all the coins a user asked for.
+
+    The whole query is tried first, as coin names can have spaces,
+    otherwise every word (or comma separated part) is a coin.
+
+    Args:
+        q: the user provided coin(s) to find.
+
+    Returns:
+        A list of (cid, symbol, name) tuples found and a list of queries
+        which were not in the coin list.
+
+    Raises:
+        sqlite3.Error if the coin index is missing.
+    """
+    try:
+        return [find_coin_id(q)], []
+    except ValueError:
+        pass
+
+    found, missing = [], []
+    for part in q.replace(',', ' ').split()[:MAX_COINS]:
+        try:
+            coin = find_coin_id(part)
+            if coin not in found:
+                found.append(coin)
+        except ValueError:
+            missing.append(part)
+    return found, missing
+
+
+def fetch_markets(cids: list[str]) -> dict[str, dict]:
+    """
+    Fetch the market data of many coins in a single request.
+
+    Args:
+        cids: CoinGecko coin ids.
+
+    Returns:
+        Dict of coin id to the market data of the coin.
+
+    Raises:
         JSONDecodeError when the API returns an invalid json doc.
-        Exception the request module could have failed as well.
+        urllib.error.* on request failures.
     """
-    for coin in COIN_LIST:
-        cid = coin.get('id', '')
-        symbol = coin.get('symbol', '')
-        name = coin.get('name', '')
+    data = request_json(COIN_MARKETS,
+                        query={'vs_currency': REAL_COIN,
+                               'ids': ','.join(cids),
+                               'price_change_percentage': '24h,7d,30d'})
+    return {coin['id']: coin for coin in data}
+
+
+def get_markets(cids: list[str]) -> dict[str, dict]:
+    """
+    Get the market data of many coins, using the shared price cache.
+
+    Only coins which are not cached are fetched; concurrent lookups of the
+    same coins wait for a single request.
 
-        if q.lower() == name.lower() or q.lower() == symbol:
-            return cid, symbol, name
+    Args:
+        cids: CoinGecko coin ids.
+
+    Returns:
+        Dict of coin id to the market data of the coin.
 
-    raise ValueError(f"'{q}' is not in the coin list.")
+    Raises:
+        JSONDecodeError when the API returns an invalid json doc.
+        urllib.error.* on request failures.
+    """
+    def fetch(keys: list[str]) -> dict[str, dict]:
+        markets = fetch_markets([key.split(':', 1)[0] for key in keys])
+        return {f'{cid}:{REAL_COIN}': market
+                for cid, market in markets.items()}
+
+    cached = PRICE_CACHE.fetch_many([f'{cid}:{REAL_COIN}' for cid in cids],
+                                    fetch, PRICE_CACHE_TTL)
+    return {key.split(':', 1)[0]: market for key, market in cached.items()}
+
+
+def fmt_change(period: str, change: Optional[float]) -> str:
+    """Colorize a price change percentage."""
+    if change is None:
+        return f'{period}: n/a'
+    elif change < 0:
+        return f'{period}: \x0304{change:.2f}%\x03'
+    else:
+        return f'{period}: \x0303+{change:.2f}%\x03'
+
+
+def fmt_coin(symbol: str, name: str, market: dict) -> str:
+    """
+    Format the full market details of a coin.
+
+    Raises:
+        KeyError if the CoinGecko API has changed the shape
+                 of their JSON.
+    """
+    current = market['current_price']
+    high = market['high_24h']
+    low = market['low_24h']
+    volume = market['total_volume']
+    cap = market['market_cap']
+    change_24h = market['price_change_percentage_24h_in_currency']
+    change_7d = market['price_change_percentage_7d_in_currency']
+    change_30d = market['price_change_percentage_30d_in_currency']
+
+    return (f'{name} ({symbol}) '
+            f'Current: \x0307${current:,}\x03, '
+            f'High: \x0307${high:,}\x03, '
+            f'Low: \x0307${low:,}\x03, '
+            f'Vol: ${volume:,}, '
+            f'Cap: ${cap:,}, '
+            f'{fmt_change("24h", change_24h)}, '
+            f'{fmt_change("7d", change_7d)}, '
+            f'{fmt_change("30d", change_30d)}')
+
+
+def fmt_coin_short(symbol: str, market: dict) -> str:
+    """
+    Format the current price of a coin for a list of coins.
+
+    Raises:
+        KeyError if the CoinGecko API has changed the shape
+                 of their JSON.
+    """
+    current = market['current_price']
+    change_24h = market['price_change_percentage_24h_in_currency']
+    return (f'{symbol.upper()} \x0307${current:,}\x03 '
+            f'{fmt_change("24h", change_24h)}')
 
 
 def cryptocoin(q: str) -> str:
     """
-    Fetch a string suitable for output to IRC about a given coin.
+    Fetch a string suitable for output to IRC about the given coin(s).
 
     Args:
-        q: the coin the user wants info on.
+        q: the coin(s) the user wants info on.
 
     Returns:
-        Single line about the coin, or an error message.
+        Single line about the coin(s), a paste url for long lists,
+        or an error message.
 
     Raises:
         KeyError if the CoinGecko API has changed the shape
                  of their JSON.
     """
     if q == '':
-        return "Search a coin with: .cg <name>"
+        return "Search a coin with: .cg <name> [name...]"
+
+    check_coin_list()
 
     try:
-        cid, symbol, name = find_coin_id(q)
-    except ValueError:
-        return f'Cryptocurrency {q} not found.'
+        coins, missing = find_coins(q)
+    except sqlite3.Error as e:
+        log_e(f'Coin list is unavailable: {e}')
+        return 'The coin list is unavailable; try again later.'
+
+    not_found = f'Cryptocurrency {", ".join(missing)} not found.'
+    if len(coins) == 0:
+        return not_found
 
     try:
-        data = request_json(f'{COIN_GECKO}{quote(cid)}?{QUERY}')
+        markets = get_markets([cid for cid, _, _ in coins])
     except JSONDecodeError:
         log_e('API Error trying to get coin data.')
         return 'Unknown API Error; try again later.'
-    except URLError as e:
-        log_e(f'CoinGecko down? {e}')
-        return 'CoinGecko appears to be down.'
     except HTTPError as e:
         log_e(f'CoinGecko may be blocking us: {e}')
         return 'CoinGecko appears to be misbehaving.'
+    except URLError as e:
+        log_e(f'CoinGecko down? {e}')
+        return 'CoinGecko appears to be down.'
 
-    # change this to support other (real) coins like eur, jpy, gbp, nok
-    real_coin = 'usd'
-    current = data['market_data']['current_price'][real_coin]
-    high = data['market_data']['high_24h'][real_coin]
-    low = data['market_data']['low_24h'][real_coin]
-    volume = data['market_data']['total_volume'][real_coin]
-    cap = data['market_data']['market_cap'][real_coin]
-    change_24h = data['market_data']['price_change_percentage_24h']
-    change_7d = data['market_data']['price_change_percentage_7d']
-    # change_14d = data['market_data']['price_change_percentage_14d']
-    change_30d = data['market_data']['price_change_percentage_30d']
-    # change_60d = data['market_data']['price_change_percentage_60d']
-    # change_200d = data['market_data']['price_change_percentage_200d']
-
-    output = (f'{name} ({symbol}) '
-              f'Current: \x0307${current:,}\x03, '
-              f'High: \x0307${high:,}\x03, '
-              f'Low: \x0307${low:,}\x03, '
-              f'Vol: ${volume:,}, '
-              f'Cap: ${cap:,}')
-
-    if change_24h < 0:
-        output = output + f', 24h: \x0304{change_24h:.2f}%\x03'
-    else:
-        output = output + f', 24h: \x0303+{change_24h:.2f}%\x03'
-
-    if change_7d < 0:
-        output = output + f', 7d: \x0304{change_7d:.2f}%\x03'
-    else:
-        output = output + f', 7d: \x0303+{change_7d:.2f}%\x03'
-
-    if change_30d < 0:
-        output = output + f', 30d: \x0304{change_30d:.2f}%\x03'
+    no_data = [f'No market data for {name} ({symbol}).'
+               for cid, symbol, name in coins
+               if cid not in markets]
+    if len(coins) == 1:
+        cid, symbol, name = coins[0]
+        if cid not in markets:
+            return no_data[0]
+        output = fmt_coin(symbol, name, markets[cid])
     else:
-        output = output + f', 30d: \x0303+{change_30d:.2f}%\x03'
-
+        output = ' :: '.join([fmt_coin_short(symbol, markets[cid])
+                              for cid, symbol, _ in coins
+                              if cid in markets] + no_data)
+
+    if missing:
+        output += f' - {not_found}'
+
+    if len(coins) > 1 and len(output) > LEN_LIMIT:
+        lines = [fmt_coin(symbol, name, markets[cid])
+                 for cid, symbol, name in coins
+                 if cid in markets] + no_data
+        if missing:
+            lines.append(not_found)
+        try:
+            url = paste_service(StringIO('\n'.join(lines)))
+            return f'Prices: {url}'
+        except Exception as e:
+            log_e(f'Paste service failed: {e}')
     return output
 
 
@@ -215,6 +503,9 @@ def main(*,
         print(':r Error, CoinGecko API has changed.')
         log_e(f'API Data may have changed: {e}')
         return 1
+    except TimeoutError:
+        # main_decorator replies with the timeout.
+        raise
     except Exception as e:
         print(':r Unknown Error.')
         log_e(f'Unknown Error: {e}')
@@ -223,4 +514,6 @@ def main(*,
 
 
 if __name__ == '__main__':
+    if argv[1:] == [REFRESH_FLAG]:
+        exit(0 if refresh_coin_list() else 1)
     exit(main())
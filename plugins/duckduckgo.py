@@ -13,17 +13,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from io import StringIO
 from typing import NamedTuple
 from sys import exit
 from html.parser import HTMLParser
 from urllib.parse import urlparse, parse_qsl
 
-from py8ball import main_decorator
-from py8ball.http_helpers import request, chunk_read
+from py8ball import guard_large_int, main_decorator
+from py8ball.cache import Cache
+from py8ball.deadline import DeadlineExceeded
+from py8ball.environment import get_persistant_location, get_temp_location
+from py8ball.http_helpers import (request, chunk_read, get_charset,
+                                  paste_service)
+from py8ball.logging import log_e
 
 
 SEARCH_ENGINE = "https://html.duckduckgo.com/html/"
 LEN_LIMIT = 350
+# Results parsed from a single search.
+MAX_RESULTS = 10
+# More results than this are pasted instead of replied.
+MAX_LINES = 3
+# Seconds the results of a query are cached for.
+RESULT_TTL = 60 * 60
+
+try:
+    CACHE_DIR = get_temp_location()
+except KeyError:
+    CACHE_DIR = get_persistant_location()
+RESULT_CACHE = Cache(CACHE_DIR / 'ddg-cache.db', max_entries=256)
 
 
 class DdgResult(NamedTuple):
@@ -66,17 +84,23 @@ def get_real_url(indirected_url: str) -> str:
 class DdgQueryParser(HTMLParser):
     """HTMLParser that finds anchor tags with search results."""
 
-    def __init__(self):
+    def __init__(self, max_results: int = MAX_RESULTS):
         """Set up state of the parser."""
         super().__init__(convert_charrefs=True)
         self._url: str = ''
         self._snippet: str = ''
-        self.result: DdgResult = None
+        self.max_results = max_results
+        self.results: list[DdgResult] = []
         self._in_result = False
 
+    @property
+    def done(self) -> bool:
+        """Whether enough results were found."""
+        return len(self.results) >= self.max_results
+
     def handle_starttag(self, tag, attr):
         """Hunt for anchor tags and transition the state of the parser."""
-        if self.result:
+        if self.done:
             return
 
         css_class = ''
@@ -102,7 +126,9 @@ class DdgQueryParser(HTMLParser):
     def handle_endtag(self, tag):
         """Append a result or do nothing."""
         if tag == 'a' and self._in_result:
-            self.result = DdgResult(self._url, self._snippet)
+            self.results.append(DdgResult(self._url, self._snippet))
+            self._url = ''
+            self._snippet = ''
             self._in_result = False
 
         # Terminate the bold text.
@@ -115,34 +141,123 @@ class DdgQueryParser(HTMLParser):
             self._snippet += data
 
 
-def get_answer(q: str) -> str:
+def search(q: str) -> list[DdgResult]:
     """
     Search ddg for a given query.
 
     Args:
-        q: The user supplied query.
+        q: The query.
 
     Returns:
-        Result suitable for emitting to IRC.
+        Up to MAX_RESULTS results.
     """
     with request(SEARCH_ENGINE, {'q': q}) as res:
         parser = DdgQueryParser()
         # Up to 128KiB read.
-        for frag in chunk_read(res, size=4096, times=32):
+        for frag in chunk_read(res, size=4096, times=32,
+                               encoding=get_charset(res.headers)):
             if not frag:
                 break
             parser.feed(frag)
-            # We only want one result.
-            if parser.result:
+            if parser.done:
                 break
+        return parser.results
+
+
+def get_results(q: str) -> list[DdgResult]:
+    """
+    Get the results of a query from the cache, or search for them.
+
+    Empty results are not cached, as they are as likely to be a throttled
+    search as a query without results.
+
+    Args:
+        q: The query.
+
+    Returns:
+        Up to MAX_RESULTS results.
+    """
+    key = ' '.join(q.lower().split())
+
+    def fetch(_: list[str]) -> dict[str, list]:
+        results = [list(r) for r in search(q)]
+        return {key: results} if results else {}
+
+    results = RESULT_CACHE.fetch_many([key], fetch, RESULT_TTL).get(key, [])
+    return [DdgResult(*r) for r in results]
+
+
+def fmt_result(result: DdgResult, limit: int = LEN_LIMIT) -> str:
+    """Format a result for IRC, truncating the snippet to limit."""
+    url, snippet = result
+    if len(snippet) > limit:
+        snippet = f'{snippet[0:limit]}...'
+    return f'''{snippet.lstrip()} - {url}'''
+
+
+def get_answer(q: str, count: int = 1, page: int = 1) -> list[str]:
+    """
+    Search ddg for a given query.
+
+    Args:
+        q: The user supplied query.
+        count: Number of results wanted.
+        page: Which count results, starting at 1.
+
+    Returns:
+        Lines suitable for emitting to IRC.
+    """
+    results = get_results(q)[(page - 1) * count:page * count]
+    if not results:
+        return ['No result.']
+    elif len(results) == 1:
+        return [fmt_result(results[0])]
+
+    lines = [f'{n}. {fmt_result(r, LEN_LIMIT // len(results))}'
+             for n, r in enumerate(results, (page - 1) * count + 1)]
+    if len(lines) <= MAX_LINES:
+        return lines
 
-        if parser.result:
-            url, snippet = parser.result
-            if len(snippet) > LEN_LIMIT:
-                snippet = f'{snippet[0:LEN_LIMIT]}...'
-            return f'''{snippet} - {url}'''
+    try:
+        url = paste_service(StringIO('\n'.join(
+            f'{n}. {fmt_result(r)}'
+            for n, r in enumerate(results, (page - 1) * count + 1))))
+        return [f'Results: {url}']
+    except Exception as e:
+        log_e(f'Paste service failed: {e}')
+        return lines[:MAX_LINES]
+
+
+def parse_options(message: str) -> (str, int, int):
+    """
+    Parse the leading -n count and -p page options of a query.
+
+    Args:
+        message: The message of the command.
+
+    Returns:
+        The query, the number of results and the page.
+
+    Raises:
+        ValueError if an option is not a valid number.
+    """
+    count, page = 1, 1
+    words = message.split()
+    while len(words) > 2 and words[0] in ('-n', '-p'):
+        opt, value, *words = words
+        try:
+            value = guard_large_int(value)
+        except (ValueError, OverflowError):
+            raise ValueError(f'{opt} needs a number, not {value}')
+        if opt == '-n':
+            if not 1 <= value <= MAX_RESULTS:
+                raise ValueError(f'-n must be between 1 and {MAX_RESULTS}')
+            count = value
         else:
-            return 'No result.'
+            if value < 1:
+                raise ValueError('-p must be greater than 0')
+            page = value
+    return ' '.join(words), count, page
 
 
 @main_decorator
@@ -150,17 +265,25 @@ def main(*,
          message: str = '--help',
          command: str = 'ddg') -> int:
     """Entrypoint."""
-    query = message
-    if query.startswith('--help'):
-        print(f':r {command} [--help] query')
+    if message.startswith('--help'):
+        print(f':r {command} [--help] [-n count] [-p page] query')
         exit(0)
 
+    try:
+        query, count, page = parse_options(message)
+    except ValueError as e:
+        print(f':r {e}')
+        return 1
+
     if command == 'mdn':
         query += ' site:https://developer.mozilla.org/en-US'
 
     try:
-        res = get_answer(query)
-        print(f':r {res.lstrip()}')
+        for line in get_answer(query, count, page):
+            print(f':r {line}')
+    except DeadlineExceeded:
+        # main_decorator replies with the timeout.
+        raise
     except Exception as e:
         print(f':r {e} - For query {query}')
         return 1
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from py8ball import main_decorator
+from py8ball.deadline import DeadlineExceeded
 from py8ball.http_helpers import request, request_json
 from py8ball.logging import log_w, log_e
 
@@ -79,7 +80,7 @@ def get_more_detail(api_path: str, gid: str) -> dict[str, str]:
     detail_linescore = '{}/{}/linescore.json'.format(api_path, api_gid)
     detail_eventlog = '{}/{}/eventLog.xml'.format(api_path, api_gid)
 
-    linescore = request_json(detail_linescore)
+    linescore = request_json(detail_linescore, cache=True, min_ttl=15)
 
     if not isinstance(linescore, dict):
         raise Exception('linescore is not an object')
@@ -116,6 +117,9 @@ def get_more_detail(api_path: str, gid: str) -> dict[str, str]:
         events.feed(events_xml)
         if events.latest_event != '':
             latest_event = events.latest_event
+    except DeadlineExceeded:
+        # main_decorator replies with the timeout.
+        raise
     except Exception as e:
         latest_event = str(e)
 
@@ -143,7 +147,10 @@ def mlb(inp: str = '') -> str:
     api_string = f'{api_base}/grid.json'
 
     try:
-        games_today = request_json(api_string)
+        games_today = request_json(api_string, cache=True, min_ttl=15)
+    except DeadlineExceeded:
+        # main_decorator replies with the timeout.
+        raise
     except Exception as e:
         log_e(str(e))
         return 'Failed to get games today (Note: gd2 API *is* deprecated).'
@@ -198,6 +205,9 @@ def mlb(inp: str = '') -> str:
             if inning != '':
                 try:
                     details = get_more_detail(api_base, game.get('id', 'null'))
+                except DeadlineExceeded:
+                    # main_decorator replies with the timeout.
+                    raise
                 except Exception as e:
                     log_w(f'eventLog API may be broken: {e}')
                     return outstring
@@ -13,12 +13,61 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import re
+import sqlite3
+
+from codecs import getincrementaldecoder, lookup as codec_lookup
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from html.parser import HTMLParser as HtmlParser
-from typing import TextIO
+from os import environ
+from struct import unpack_from
+from typing import Optional, TextIO
+from urllib.error import URLError
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from py8ball import LEN_LIMIT, main_decorator
-from py8ball.http_helpers import chunk_read, request
-from py8ball.logging import log_d, log_e
+from py8ball.cache import Cache
+from py8ball.circuit_breaker import ServiceUnavailable
+from py8ball.deadline import DeadlineExceeded
+from py8ball.environment import get_persistant_location, get_temp_location
+from py8ball.http_helpers import get_charset, request
+from py8ball.logging import log_e
+
+try:
+    CACHE_DIR = get_persistant_location()
+except KeyError:
+    CACHE_DIR = get_temp_location()
+TITLE_CACHE = Cache(CACHE_DIR / 'pagetitle-cache.db', max_entries=4096)
+# Seconds titles, and failures or non-HTML links, are cached for.
+TITLE_TTL = 6 * 60 * 60
+NEGATIVE_TTL = 15 * 60
+
+# Query parameters which only track where a link came from.
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid',
+                   'igshid', 'mc_cid', 'mc_eid', '_ga', 'ref_src'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Same as the pagetitle.py regexp in config.sh.
+URL_RE = re.compile(r'https?://[^ ]+')
+# Links in a single message that get a title.
+MAX_URLS = max(1, int(environ.get('PAGETITLE_MAX_URLS', 3)))
+# Bytes of a page read looking for its title.
+MAX_BYTES = int(environ.get('PAGETITLE_MAX_BYTES', 40 * 1024))
+READ_SIZE = 4096
+# Bytes searched for a <meta> charset, like browsers do.
+SNIFF_BYTES = 1024
+META_CHARSET_RE = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-z0-9_:.-]+)', re.IGNORECASE)
+# Browsers treat these labels as windows-1252.
+CP1252_ALIASES = {'iso8859-1', 'ascii'}
+# We want HTML, but other links get a description too.
+ACCEPT = 'text/html,application/xhtml+xml,*/*;q=0.8'
+# Bytes of an image read looking for its dimensions.
+IMAGE_BYTES = 64 * 1024
+# JPEG start of frame markers, which hold the dimensions.
+JPEG_SOF = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+            0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
 
 
 class TitleParser(HtmlParser):
@@ -48,19 +97,124 @@ class TitleParser(HtmlParser):
             self.title += inner_text
 
 
+def normalize_url(url: str) -> str:
+    """
+    Normalize a url, so different spellings of a link share a cache entry.
+
+    The scheme and host are lowercased, default ports, fragments and
+    tracking parameters (utm_*, fbclid, etc.) are removed.
+
+    Args:
+        url: An http(s) url.
+
+    Returns:
+        The normalized url.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        netloc = f'[{netloc}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    if parts.username is not None:
+        netloc = f'{parts.netloc.rpartition("@")[0]}@{netloc}'
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith('utm_')
+             and k.lower() not in TRACKING_PARAMS]
+    return urlunsplit((scheme, netloc, parts.path or '/',
+                       urlencode(query), ''))
+
+
+def find_urls(message: str, match: str) -> list[str]:
+    """
+    Find the links in a message, in order.
+
+    Links which normalize to the same url are only returned once.
+
+    Args:
+        message: The whole message.
+        match: The link that matched the pagetitle regexp.
+
+    Returns:
+        Up to MAX_URLS links.
+    """
+    urls = {}
+    for url in URL_RE.findall(message) or [match]:
+        urls.setdefault(normalize_url(url), url)
+    return list(urls.values())[:MAX_URLS]
+
+
+def sniff_charset(head: bytes) -> Optional[str]:
+    """
+    Find the charset of a page from a byte order mark or <meta> tag.
+
+    Args:
+        head: The start of the page.
+
+    Returns:
+        The charset, None if the page does not say.
+    """
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    match = META_CHARSET_RE.search(head[:SNIFF_BYTES])
+    return match.group(1).decode('ascii') if match is not None else None
+
+
+def page_charset(res: TextIO, head: bytes) -> str:
+    """
+    Get the charset of a page, from Content-Type or else the page itself.
+
+    Args:
+        res: The response.
+        head: The start of the page.
+
+    Returns:
+        The name of a codec, utf8 if the page does not say.
+    """
+    charset = get_charset(res.headers, None)
+    if charset is None:
+        try:
+            charset = codec_lookup(sniff_charset(head) or 'utf8').name
+        except LookupError:
+            charset = 'utf8'
+    return 'cp1252' if charset in CP1252_ALIASES else charset
+
+
 def process_res(res: TextIO) -> str:
-    """Process the HTML response."""
+    """
+    Process the HTML response.
+
+    Reads until </title> or at most MAX_BYTES, then closes the response
+    without reading the rest of the page.
+    """
     content_type = res.headers.get('Content-Type', '')
     if 'html' not in content_type:
         raise TypeError('Not (X)HTML')
 
-    parser = TitleParser()
-    for html_fragment in chunk_read(res, size=4096, times=10):
-        if not html_fragment:
+    head = b''
+    while len(head) < SNIFF_BYTES:
+        data = res.read(SNIFF_BYTES - len(head))
+        if not data:
             break
-        parser.feed(html_fragment)
-        if parser.done:
+        head += data
+
+    decoder = getincrementaldecoder(page_charset(res, head))('replace')
+    parser = TitleParser()
+    parser.feed(decoder.decode(head))
+    total = len(head)
+    while not parser.done and total < MAX_BYTES:
+        data = res.read(min(READ_SIZE, MAX_BYTES - total))
+        parser.feed(decoder.decode(data, final=not data))
+        if not data:
             break
+        total += len(data)
+    res.close()
 
     out = ' '.join(parser.title.strip().splitlines())
     if out == '':
@@ -70,27 +224,187 @@ def process_res(res: TextIO) -> str:
     return out
 
 
+def jpeg_size(data: bytes) -> Optional[tuple[int, int]]:
+    """Find the dimensions in the start of frame segment of a JPEG."""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xff:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xff:
+            # fill byte.
+            pos += 1
+        elif 0xd0 <= marker <= 0xd9 or marker == 0x01:
+            # markers without a length.
+            pos += 2
+        elif marker in JPEG_SOF:
+            if pos + 9 > len(data):
+                return None
+            height, width = unpack_from('>HH', data, pos + 5)
+            return width, height
+        else:
+            pos += 2 + unpack_from('>H', data, pos + 2)[0]
+    return None
+
+
+def image_size(data: bytes) -> Optional[tuple[int, int]]:
+    """
+    Get the dimensions of a PNG, GIF, JPEG, WebP or BMP image.
+
+    Args:
+        data: The start of the image.
+
+    Returns:
+        Tuple of width and height, None if the format is unknown or data
+        does not have them yet.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n') and len(data) >= 24:
+        return unpack_from('>II', data, 16)
+    elif data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return unpack_from('<HH', data, 6)
+    elif data.startswith(b'\xff\xd8'):
+        return jpeg_size(data)
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = unpack_from('<HH', data, 26)
+            return width & 0x3fff, height & 0x3fff
+        elif chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        elif chunk == b'VP8X':
+            return (int.from_bytes(data[24:27], 'little') + 1,
+                    int.from_bytes(data[27:30], 'little') + 1)
+    elif data.startswith(b'BM') and len(data) >= 26:
+        if unpack_from('<I', data, 14)[0] == 12:
+            return unpack_from('<HH', data, 18)
+        width, height = unpack_from('<ii', data, 18)
+        return width, abs(height)
+    return None
+
+
+def human_size(size: int) -> str:
+    """Format a number of bytes, e.g. 1.5 MiB."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+    return f'{size} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+
+
+def process_file(res: TextIO) -> str:
+    """
+    Describe a non-HTML response from its headers.
+
+    The dimensions of images are read from at most IMAGE_BYTES of the file;
+    nothing else is read.
+    """
+    content_type = res.headers.get_content_type()
+    details = []
+
+    if content_type.startswith('image/'):
+        data = b''
+        size = None
+        while size is None and len(data) < IMAGE_BYTES:
+            chunk = res.read(min(READ_SIZE, IMAGE_BYTES - len(data)))
+            if not chunk:
+                break
+            data += chunk
+            size = image_size(data)
+        if size is not None:
+            details.append(f'{size[0]}x{size[1]}')
+    res.close()
+
+    length = res.headers.get('Content-Length', '')
+    if length.isdigit() and 'Content-Encoding' not in res.headers:
+        details.append(human_size(int(length)))
+
+    if details:
+        return f'{content_type} :: {", ".join(details)}'
+    return content_type
+
+
+def get_title(url: str) -> (dict[str, str], float):
+    """
+    Fetch the title of a link.
+
+    Args:
+        url: An http(s) url.
+
+    Returns:
+        Dict with either the title, a description of a non-HTML file or
+        an error, and the seconds it can be cached for.
+    """
+    try:
+        with request(url, headers={'Accept': ACCEPT}) as res:
+            try:
+                return {'title': process_res(res)}, TITLE_TTL
+            except TypeError:
+                return {'file': process_file(res)}, NEGATIVE_TTL
+    except ServiceUnavailable as e:
+        return {'error': str(e)}, 0
+    # dead links, HTTPError is an URLError.
+    except URLError as e:
+        # connect and handshake timeouts; the link may be slow, not dead.
+        if isinstance(e.reason, TimeoutError):
+            return {'error': str(e)}, 0
+        return {'error': str(e)}, NEGATIVE_TTL
+    except DeadlineExceeded:
+        # main_decorator replies with the timeout.
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 0
+
+
+def lookup(url: str) -> dict[str, str]:
+    """Get the title of a link from the cache, or fetch it; see get_title."""
+    key = normalize_url(url)
+    # the cache only saves requests; titles are fetched without it.
+    try:
+        res = TITLE_CACHE.get(key)
+    except sqlite3.Error as e:
+        log_e(f'Title cache is unavailable: {e}')
+        res = None
+    if res is None:
+        res, ttl = get_title(url)
+        if ttl > 0:
+            try:
+                TITLE_CACHE.put(key, res, ttl)
+            except sqlite3.Error as e:
+                log_e(f'Title cache is unavailable: {e}')
+    return res
+
+
 @main_decorator
 def main(*,
-         match: str = ''):
+         match: str = '',
+         message: str = ''):
     """Entrypoint."""
-    url = match
-    if not (url.startswith('http://') or url.startswith('https://')):
-        log_e(f'Matched text - {url} - is not an http url.')
+    if not (match.startswith('http://') or match.startswith('https://')):
+        log_e(f'Matched text - {match} - is not an http url.')
         return 1
 
-    try:
-        with request(url) as res:
-            title = process_res(res)
-            print(f':r ↑ Title :: {title}')
-    # We don't handle non-HTML currently.
-    except TypeError:
-        log_d('TODO: Handle image, and other data.')
-        return 1
-    except Exception as e:
-        print(f':r {e} - ({url})')
-
-    return 0
+    urls = find_urls(message, match)
+    ret = 1
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        # each fetch runs within the deadline of this invocation.
+        results = [pool.submit(copy_context().run, lookup, url)
+                   for url in urls]
+        # print in message order, as soon as the earlier links are done.
+        for url, result in zip(urls, results):
+            res = result.result()
+            if 'title' in res:
+                print(f':r ↑ Title :: {res["title"]}', flush=True)
+            elif 'file' in res:
+                print(f':r ↑ {res["file"]}', flush=True)
+            elif 'error' in res:
+                print(f':r {res["error"]} - ({url})', flush=True)
+            else:
+                continue
+            ret = 0
+    return ret
 
 
 if __name__ == '__main__':
@@ -12,15 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from inspect import signature
+from inspect import getfile, signature
 from functools import wraps
+from os import _exit
+from pathlib import Path
+from signal import ITIMER_REAL, SIGALRM, setitimer, signal
+from sys import argv, stdout
 from typing import Callable, Optional
 
 from .arguments import get_argsl
+from .deadline import get_budget, within
 from .logging import log_e
 
 
 LEN_LIMIT = 350
+# Seconds past its time budget a plugin process is killed after.
+HARD_TIMEOUT_GRACE = 5
 
 
 def guard_large_int(inp: str,
@@ -64,6 +71,11 @@ def main_decorator(func: Callable) -> Callable:
     using kwargs.
     If you want, say --message=value only, define your main()
     as `main(message):`
+    The wrapped function can be called with an explicit argument list;
+    this is how the persistent plugin host (see .host) runs plugins.
+    The plugin runs under a deadline (see .deadline) of its time budget,
+    replying `:r timed out` if it is exceeded. When run as a script,
+    the process is also killed shortly after the budget is used up.
     If you want the "command" name, you'd use main(*, command):
     Regexps would be main(*, match, regexp):
     see Example below.
@@ -87,12 +99,23 @@ def main_decorator(func: Callable) -> Callable:
         Wrapped callable which returns an exit code.
     """
     argspec = signature(func)
+    budget = get_budget(Path(getfile(func)).stem)
+
+    def hard_timeout(*_):
+        print(':r timed out')
+        log_e(f'killed after {budget + HARD_TIMEOUT_GRACE}s.')
+        stdout.flush()
+        _exit(1)
 
     @wraps(func)
-    def w() -> int:
+    def w(arglist: Optional[list[str]] = None) -> int:
         try:
             new_args = {}
-            for flag, value in get_argsl():
+            if arglist is None:
+                arglist = argv[1:]
+                signal(SIGALRM, hard_timeout)
+                setitimer(ITIMER_REAL, budget + HARD_TIMEOUT_GRACE)
+            for flag, value in get_argsl(arglist):
                 real_flag = flag.value[2:]
                 if real_flag in argspec.parameters:
                     new_args[real_flag] = value
@@ -100,5 +123,12 @@ def main_decorator(func: Callable) -> Callable:
             log_e(str(e))
             return 1
 
-        return func(**new_args)
+        try:
+            with within(budget):
+                return func(**new_args)
+        except TimeoutError as e:
+            print(':r timed out')
+            log_e(str(e))
+            return 1
+    w.py8ball_main = True
     return w
@@ -0,0 +1,262 @@
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+from contextlib import ExitStack, contextmanager
+from fcntl import flock, LOCK_EX
+from hashlib import sha1
+from json import dumps as json_dumps, loads as json_loads
+from pathlib import Path
+from time import time
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+from .sqlite3_helpers import Sqlite3Manager
+
+
+# Number of lock files used to coalesce fetches.
+LOCK_BUCKETS = 64
+
+
+class Cache():
+    """
+    Key/value cache shared by every plugin process, backed by sqlite3.
+
+    Values are anything that can be serialized as JSON.
+    Entries expire after their TTL and the least recently used entries
+    are evicted once the cache has more than max_entries entries,
+    or, optionally, more than max_bytes of serialized values.
+    """
+
+    def __init__(self,
+                 dbpath: Union[str, Path],
+                 max_entries: int = 1024,
+                 max_bytes: Optional[int] = None):
+        """Init state of the cache; the database is created on first use."""
+        self.dbpath = Path(dbpath)
+        self.db = Sqlite3Manager(self.dbpath)
+        self.lock_dir = self.dbpath.with_name(f'{self.dbpath.name}.locks')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._setup = False
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Open the cache database, creating the schema if needed."""
+        with self.db.connect() as db:
+            if not self._setup:
+                db.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key      TEXT PRIMARY KEY NOT NULL,
+                    value    TEXT NOT NULL,
+                    expires  REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    size     INTEGER NOT NULL
+                );
+                """)
+                db.execute("""
+                CREATE INDEX IF NOT EXISTS cacheIdxAccessed
+                ON cache (accessed);
+                """)
+                self._setup = True
+            yield db
+
+    def get_entry(self, key: str) -> Optional[tuple[Any, float]]:
+        """
+        Get a value from the cache, even if it has expired.
+
+        Args:
+            key: The key of the value.
+
+        Returns:
+            Tuple of the value and the unix time it expires at,
+            or None if the key is not in the cache.
+        """
+        with self.connect() as db:
+            row = db.execute("""
+            SELECT value, expires FROM cache WHERE key = ?;
+            """, (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("""
+            UPDATE cache SET accessed = ? WHERE key = ?;
+            """, (time(), key))
+        return json_loads(row[0]), row[1]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get a value from the cache.
+
+        Args:
+            key: The key of the value.
+            default: Returned when the value is not cached or expired.
+
+        Returns:
+            The cached value.
+        """
+        entry = self.get_entry(key)
+        if entry is None or entry[1] < time():
+            return default
+        return entry[0]
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """
+        Get all the unexpired values for the given keys.
+
+        Args:
+            keys: The keys of the values.
+
+        Returns:
+            Dict of key to value for every key that was cached.
+        """
+        ret = {}
+        now = time()
+        with self.connect() as db:
+            for key in keys:
+                row = db.execute("""
+                SELECT value FROM cache WHERE key = ? AND expires >= ?;
+                """, (key, now)).fetchone()
+                if row is not None:
+                    ret[key] = json_loads(row[0])
+            db.executemany("""
+            UPDATE cache SET accessed = ? WHERE key = ?;
+            """, ((now, key) for key in ret))
+        return ret
+
+    def put_many(self, values: dict[str, Any], ttl: float):
+        """
+        Store values in the cache and evict the least recently used entries.
+
+        Args:
+            values: Dict of key to value.
+            ttl: Seconds until the values expire.
+        """
+        now = time()
+        rows = []
+        for key, value in values.items():
+            value = json_dumps(value)
+            rows.append((key, value, now + ttl, now, len(value)))
+
+        with self.connect() as db:
+            db.executemany("""
+            INSERT OR REPLACE INTO cache (key, value, expires, accessed, size)
+            VALUES (?, ?, ?, ?, ?);
+            """, rows)
+            db.execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key,
+                           row_number() OVER lru AS n,
+                           sum(size) OVER lru AS total
+                    FROM cache
+                    WINDOW lru AS (ORDER BY accessed DESC)
+                )
+                WHERE n > ? OR total > ?
+            );
+            """, (self.max_entries,
+                  self.max_bytes if self.max_bytes is not None else 2**63-1))
+
+    def put(self, key: str, value: Any, ttl: float):
+        """
+        Store a value in the cache.
+
+        Args:
+            key: The key of the value.
+            value: Value to cache.
+            ttl: Seconds until the value expires.
+        """
+        self.put_many({key: value}, ttl)
+
+    def delete(self, key: str):
+        """Remove a key from the cache."""
+        with self.connect() as db:
+            db.execute('DELETE FROM cache WHERE key = ?;', (key,))
+
+    @contextmanager
+    def lock(self, keys: Iterable[str]) -> Iterator[None]:
+        """
+        Exclusively lock the given keys across all processes and threads.
+
+        Keys are hashed into a fixed number of lock files, which are always
+        taken in the same order to prevent deadlocks.
+
+        Args:
+            keys: The keys to lock.
+        """
+        buckets = sorted({int(sha1(key.encode()).hexdigest(), 16)
+                          % LOCK_BUCKETS
+                          for key in keys})
+        self.lock_dir.mkdir(mode=0o700, exist_ok=True)
+        with ExitStack() as stack:
+            for bucket in buckets:
+                f = stack.enter_context(
+                    (self.lock_dir / f'{bucket}.lock').open('a'))
+                flock(f, LOCK_EX)
+            yield
+
+    def fetch_many(self,
+                   keys: Iterable[str],
+                   fetch: Callable[[list[str]], dict[str, Any]],
+                   ttl: float) -> dict[str, Any]:
+        """
+        Get values from the cache, fetching the ones that are missing.
+
+        Concurrent misses for the same keys wait on a single fetch
+        instead of all calling fetch.
+
+        Args:
+            keys: The keys of the values.
+            fetch: Called with a list of missing keys, returns a dict
+                   of key to value. Keys it does not return are not cached.
+            ttl: Seconds until fetched values expire.
+
+        Returns:
+            Dict of key to value.
+
+        Raises:
+            Anything fetch raises.
+        """
+        keys = list(dict.fromkeys(keys))
+        ret = self.get_many(keys)
+        missing = [key for key in keys if key not in ret]
+        if not missing:
+            return ret
+
+        with self.lock(missing):
+            # someone else may have fetched these while we waited.
+            ret.update(self.get_many(missing))
+            missing = [key for key in keys if key not in ret]
+            if missing:
+                fetched = fetch(missing)
+                self.put_many(fetched, ttl)
+                ret.update(fetched)
+        return ret
+
+    def fetch(self,
+              key: str,
+              fetch: Callable[[], Any],
+              ttl: float) -> Any:
+        """
+        Get a value from the cache, or fetch it.
+
+        See fetch_many.
+
+        Args:
+            key: The key of the value.
+            fetch: Called with no arguments when the key is missing.
+            ttl: Seconds until the fetched value expires.
+
+        Returns:
+            The cached or fetched value.
+        """
+        return self.fetch_many([key], lambda _: {key: fetch()}, ttl)[key]
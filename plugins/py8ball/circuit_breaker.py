@@ -0,0 +1,197 @@
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+from contextlib import contextmanager
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from time import time
+from typing import Iterator, Optional, Union
+from urllib.error import URLError
+
+from .environment import get_persistant_location, get_temp_location
+from .logging import log_w
+from .sqlite3_helpers import Sqlite3Manager
+
+
+class ServiceUnavailable(URLError):
+    """Raised instead of contacting a host which is known to be down."""
+
+    def __init__(self, host: str, retry_in: float):
+        """Say which host is down and for how long."""
+        super().__init__(f'{host} is unavailable; '
+                         f'try again in {int(retry_in) + 1}s.')
+        self.host = host
+        self.retry_in = retry_in
+
+
+def retry_after(headers: Message) -> Optional[float]:
+    """
+    Parse the Retry-After header of a response.
+
+    Args:
+        headers: The response headers.
+
+    Returns:
+        Seconds to wait, or None if there is no valid Retry-After.
+    """
+    value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker():
+    """
+    Failure tracking per host, shared by every plugin process.
+
+    After threshold failed requests in a row, the circuit of a host opens
+    and requests to it fail immediately with ServiceUnavailable.
+    It stays open for open_for seconds, doubling with every further
+    failure up to max_open_for, or for as long as the host asked us to
+    with Retry-After.
+    Once open, the next request after the wait is let through; the circuit
+    closes again when a request succeeds.
+    """
+
+    def __init__(self,
+                 dbpath: Union[str, Path],
+                 threshold: int = 3,
+                 open_for: float = 30,
+                 max_open_for: float = 600):
+        """Init state of the breaker; the database is created on first use."""
+        self.db = Sqlite3Manager(dbpath)
+        self.threshold = threshold
+        self.open_for = open_for
+        self.max_open_for = max_open_for
+        self._setup = False
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Open the state database, creating the schema if needed."""
+        with self.db.connect() as db:
+            if not self._setup:
+                db.execute("""
+                CREATE TABLE IF NOT EXISTS circuit (
+                    host       TEXT PRIMARY KEY NOT NULL,
+                    failures   INTEGER NOT NULL,
+                    open_until REAL NOT NULL
+                );
+                """)
+                self._setup = True
+            yield db
+
+    def check(self, host: str) -> bool:
+        """
+        Check that a host may be contacted.
+
+        Args:
+            host: The host, including the port if any.
+
+        Returns:
+            True if the host has recent failures.
+
+        Raises:
+            ServiceUnavailable if the circuit of the host is open.
+        """
+        try:
+            with self.connect() as db:
+                row = db.execute("""
+                SELECT open_until FROM circuit WHERE host = ?;
+                """, (host,)).fetchone()
+        except sqlite3.Error as e:
+            log_w(f'Circuit state is unavailable: {e}')
+            return False
+
+        if row is None:
+            return False
+        retry_in = row[0] - time()
+        if retry_in > 0:
+            raise ServiceUnavailable(host, retry_in)
+        return True
+
+    def success(self, host: str):
+        """Close the circuit of a host."""
+        try:
+            with self.connect() as db:
+                db.execute('DELETE FROM circuit WHERE host = ?;', (host,))
+        except sqlite3.Error as e:
+            log_w(f'Circuit state is unavailable: {e}')
+
+    def failure(self, host: str, wait: Optional[float] = None):
+        """
+        Record a failed request to a host.
+
+        Args:
+            host: The host, including the port if any.
+            wait: Seconds the host asked us to wait (Retry-After), which
+                  opens the circuit right away.
+        """
+        now = time()
+        try:
+            with self.connect() as db:
+                db.execute("""
+                INSERT INTO circuit (host, failures, open_until)
+                VALUES (?, 1, 0)
+                ON CONFLICT (host) DO UPDATE SET failures = failures + 1;
+                """, (host,))
+                # no RETURNING, which needs sqlite 3.35.
+                row = db.execute("""
+                SELECT failures FROM circuit WHERE host = ?;
+                """, (host,)).fetchone()
+                failures = row[0]
+                open_until = 0.0
+                if failures >= self.threshold:
+                    open_until = now + min(
+                        self.max_open_for,
+                        self.open_for * 2**(failures - self.threshold))
+                if wait is not None:
+                    open_until = max(open_until,
+                                     now + min(wait, self.max_open_for))
+                db.execute("""
+                UPDATE circuit SET open_until = ? WHERE host = ?;
+                """, (open_until, host))
+        except sqlite3.Error as e:
+            log_w(f'Circuit state is unavailable: {e}')
+
+
+_breaker: Optional[CircuitBreaker] = None
+
+
+def get_breaker() -> Optional[CircuitBreaker]:
+    """
+    Get the circuit breaker, which keeps its state in PLUGIN_TEMP.
+
+    Returns:
+        The breaker, or None if there is nowhere to keep its state.
+    """
+    global _breaker
+    if _breaker is None:
+        try:
+            path = get_temp_location()
+        except KeyError:
+            try:
+                path = get_persistant_location()
+            except KeyError:
+                return None
+        _breaker = CircuitBreaker(path / 'http-circuit.db')
+    return _breaker
@@ -0,0 +1,122 @@
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import environ
+from time import monotonic
+from typing import Iterator, Optional
+
+
+# Seconds a plugin invocation may take, unless configured.
+DEFAULT_BUDGET = 15.0
+
+_deadline: ContextVar[Optional[float]] = ContextVar('py8ball_deadline',
+                                                    default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time budget of the current plugin invocation is used up."""
+
+
+def get_budget(plugin: str) -> float:
+    """
+    Get the time budget of a plugin.
+
+    <PLUGIN>_TIMEOUT (e.g. COINGECKO_TIMEOUT) takes precedence over
+    PY8BALL_TIMEOUT, which applies to every plugin.
+
+    Args:
+        plugin: The name of the plugin, without extension.
+
+    Returns:
+        The budget in seconds.
+    """
+    for env in (f'{plugin.upper()}_TIMEOUT', 'PY8BALL_TIMEOUT'):
+        try:
+            return float(environ[env])
+        except (KeyError, ValueError):
+            pass
+    return DEFAULT_BUDGET
+
+
+@contextmanager
+def within(seconds: float) -> Iterator[None]:
+    """
+    Set a deadline for everything run in this context.
+
+    Nested deadlines can only shorten the current one.
+
+    Args:
+        seconds: Seconds from now until the deadline.
+    """
+    when = monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        when = min(when, current)
+    token = _deadline.set(when)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the time left until the deadline.
+
+    Returns:
+        Seconds left, or None if there is no deadline.
+
+    Raises:
+        DeadlineExceeded if the deadline has passed.
+    """
+    when = _deadline.get()
+    if when is None:
+        return None
+    left = when - monotonic()
+    if left <= 0:
+        raise DeadlineExceeded('timed out')
+    return left
+
+
+def check():
+    """
+    Raise if the deadline has passed.
+
+    Raises:
+        DeadlineExceeded if the deadline has passed.
+    """
+    remaining()
+
+
+def timeout(limit: Optional[float] = None) -> Optional[float]:
+    """
+    Get a timeout for a blocking operation, e.g. a socket read.
+
+    Args:
+        limit: Longest timeout wanted, regardless of the deadline.
+
+    Returns:
+        The smaller of limit and the time left, None if neither is set.
+
+    Raises:
+        DeadlineExceeded if the deadline has passed.
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    elif limit is None:
+        return left
+    return min(left, limit)
@@ -36,6 +36,21 @@ def get_persistant_location() -> Path:
         return path
 
 
+def get_temp_location() -> Path:
+    """
+    Gets the PLUGIN_TEMP directory neo8ball creates for plugins.
+
+    Anything stored here is removed when neo8ball stops.
+
+    Returns:
+        Pathlib object of the path stored in PLUGIN_TEMP
+
+    Raises:
+        KeyError when PLUGIN_TEMP does not exist.
+    """
+    return Path(environ['PLUGIN_TEMP'])
+
+
 def check_channel_list(env: str, channel: str) -> bool:
     """
     Check if a given environment variable contains a channel.
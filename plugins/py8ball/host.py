@@ -0,0 +1,219 @@
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent host for python plugins.
+
+Plugins are imported once and every event is run in a thread of this
+process instead of a fresh interpreter.
+ircbot.sh sends one event per connection to a Unix socket:
+
+    plugin.py\\0--reply=#chan\\0--nick=nick\\0...\\0\\0
+
+That is, the plugin file name followed by the same arguments the plugin
+would get on its command line, all NUL terminated, and an empty field to
+end the frame.
+Anything the plugin prints (:r, :m, :loge, etc.) is written back on the
+same connection, which is closed when the plugin returns.
+
+Usage:
+    PYTHONPATH=plugins python3 -m py8ball.host socket plugin_dir plugin.py...
+"""
+
+import os
+import socketserver
+import sys
+
+from contextvars import ContextVar
+from importlib.util import module_from_spec, spec_from_file_location
+from io import TextIOWrapper
+from pathlib import Path
+from signal import SIGTERM, signal
+from subprocess import run
+from typing import Callable, Optional, TextIO
+
+from .logging import log_e, log_i, log_w
+
+
+# Largest event we accept; IRC lines are at most 512 bytes.
+MAX_FRAME = 16 * 1024
+
+_event_out: ContextVar[Optional[TextIO]] = ContextVar('py8ball_event_out',
+                                                      default=None)
+
+
+class EventStdout():
+    """sys.stdout replacement writing to the current event's connection."""
+
+    def __init__(self, fallback: TextIO):
+        """Write to fallback when not handling an event."""
+        self.fallback = fallback
+
+    def _out(self) -> TextIO:
+        out = _event_out.get()
+        return self.fallback if out is None else out
+
+    def write(self, s: str) -> int:
+        """Write to the connection of the event."""
+        return self._out().write(s)
+
+    def flush(self):
+        """Flush the connection of the event."""
+        self._out().flush()
+
+    def __getattr__(self, attr):
+        """Delegate everything else to the real stdout."""
+        return getattr(self.fallback, attr)
+
+
+def read_frame(f) -> list[str]:
+    """
+    Read a single framed event.
+
+    Args:
+        f: binary file to read from.
+
+    Returns:
+        List of the plugin name and its arguments.
+
+    Raises:
+        ValueError if the frame is malformed or too large.
+    """
+    frame = b''
+    while not frame.endswith(b'\0\0'):
+        chunk = f.read1(MAX_FRAME)
+        if not chunk:
+            raise ValueError('Connection closed mid frame.')
+        frame += chunk
+        if len(frame) > MAX_FRAME:
+            raise ValueError('Frame is too large.')
+    return frame[:-2].decode('utf8', 'replace').split('\0')
+
+
+def load_plugin(path: Path) -> Optional[Callable]:
+    """
+    Import a plugin and return its main_decorator wrapped entrypoint.
+
+    Args:
+        path: path to the plugin.
+
+    Returns:
+        The plugin's main, or None if it can not be hosted.
+    """
+    spec = spec_from_file_location(f'py8ball_plugin_{path.stem}', path)
+    if spec is None:
+        return None
+    module = module_from_spec(spec)
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+    except (Exception, SystemExit) as e:
+        log_w(f'Could not import {path.name}, will run it directly: {e!r}')
+        return None
+
+    main = getattr(module, 'main', None)
+    if not getattr(main, 'py8ball_main', False):
+        log_w(f'{path.name} does not use main_decorator, '
+              'will run it directly.')
+        return None
+    return main
+
+
+class PluginHandler(socketserver.StreamRequestHandler):
+    """Run a single event."""
+
+    # only applies to reading the frame, plugins may take longer.
+    timeout = 5
+
+    def handle(self):
+        """Read the event, run the plugin and write its output back."""
+        try:
+            name, *args = read_frame(self.rfile)
+        except (ValueError, OSError) as e:
+            log_e(f'Bad event: {e}')
+            return
+        self.connection.settimeout(None)
+
+        if name not in self.server.plugin_names:
+            log_e(f'Unknown plugin: {name}')
+            return
+
+        out = TextIOWrapper(self.wfile, encoding='utf8', write_through=True)
+        token = _event_out.set(out)
+        try:
+            main = self.server.plugins.get(name)
+            if main is None:
+                run([self.server.plugin_dir / name, *args],
+                    stdout=self.connection.fileno())
+            else:
+                main(args)
+        except SystemExit:
+            pass
+        except Exception as e:
+            log_e(f'{name} raised: {e!r}')
+        finally:
+            _event_out.reset(token)
+            out.detach()
+
+
+class PluginHost(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server holding the imported plugins."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, plugin_dir: Path, names: list[str]):
+        """Import all the plugins and bind the socket."""
+        self.plugin_dir = plugin_dir
+        self.plugin_names = set(names)
+        self.plugins = {}
+        for name in self.plugin_names:
+            if '/' in name:
+                log_e(f'Invalid plugin name: {name}')
+                continue
+            main = load_plugin(plugin_dir / name)
+            if main is not None:
+                self.plugins[name] = main
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        super().__init__(socket_path, PluginHandler)
+
+
+def main() -> int:
+    """Entrypoint."""
+    if len(sys.argv) < 3:
+        log_e('usage: py8ball.host socket plugin_dir [plugin...]')
+        return 1
+
+    socket_path = sys.argv[1]
+    plugin_dir = Path(sys.argv[2]).resolve()
+    # plugins expect to be able to import their siblings.
+    sys.path.insert(0, str(plugin_dir))
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stdout = EventStdout(sys.stdout)
+    signal(SIGTERM, lambda *_: sys.exit(0))
+
+    with PluginHost(socket_path, plugin_dir, sys.argv[3:]) as server:
+        log_i(f'Hosting {", ".join(sorted(server.plugins))}.')
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,198 @@
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from base64 import b64decode, b64encode
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from http.client import HTTPMessage
+from io import BytesIO
+from time import time
+from typing import Optional
+
+from .cache import Cache
+from .environment import get_persistant_location, get_temp_location
+
+
+# Largest body that is stored, in bytes.
+MAX_BODY = 1024 * 1024
+# Bounds of the whole cache.
+MAX_ENTRIES = 512
+MAX_BYTES = 32 * 1024 * 1024
+
+_cache: Optional[Cache] = None
+
+
+def get_cache() -> Optional[Cache]:
+    """
+    Get the response cache, which is kept in PLUGIN_TEMP.
+
+    Returns:
+        The cache, or None if there is nowhere to keep it.
+    """
+    global _cache
+    if _cache is None:
+        try:
+            path = get_temp_location()
+        except KeyError:
+            try:
+                path = get_persistant_location()
+            except KeyError:
+                return None
+        _cache = Cache(path / 'http-cache.db',
+                       max_entries=MAX_ENTRIES,
+                       max_bytes=MAX_BYTES)
+    return _cache
+
+
+def freshness(headers: Message) -> Optional[float]:
+    """
+    Work out how long a response is fresh for.
+
+    Args:
+        headers: The response headers.
+
+    Returns:
+        Seconds the response is fresh for, None if it must not be stored.
+    """
+    directives = {}
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+
+    if 'no-store' in directives:
+        return None
+    elif 'no-cache' in directives:
+        return 0
+    elif 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']))
+        except ValueError:
+            return 0
+
+    try:
+        expires = parsedate_to_datetime(headers['Expires']).timestamp()
+        date = parsedate_to_datetime(headers['Date']).timestamp() \
+            if 'Date' in headers else time()
+        return max(0, expires - date)
+    except (TypeError, ValueError):
+        return 0
+
+
+def store(cache: Cache,
+          key: str,
+          url: str,
+          headers: Message,
+          body: bytes,
+          min_ttl: float):
+    """
+    Store a response in the cache.
+
+    Responses are kept past their freshness if they have validators,
+    so they can be revalidated with a conditional request.
+
+    Args:
+        cache: The response cache.
+        key: Cache key of the request.
+        url: Final url of the response.
+        headers: The response headers.
+        body: The decoded response body.
+        min_ttl: Lower bound of the freshness, set by the plugin.
+    """
+    ttl = freshness(headers)
+    if ttl is None or len(body) > MAX_BODY:
+        return
+    ttl = max(ttl, min_ttl)
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if ttl <= 0 and etag is None and last_modified is None:
+        return
+
+    cache.put(key, {'url': url,
+                    'headers': [(k, v) for k, v in headers.items()
+                                if k.lower() not in ('content-encoding',
+                                                     'content-length',
+                                                     'transfer-encoding')],
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'body': b64encode(body).decode('ascii')}, ttl)
+
+
+def refresh(cache: Cache,
+            key: str,
+            value: dict,
+            headers: Message,
+            min_ttl: float):
+    """
+    Extend the freshness of a cached response after a 304 Not Modified.
+
+    Args:
+        cache: The response cache.
+        key: Cache key of the request.
+        value: The cached response.
+        headers: The headers of the 304 response.
+        min_ttl: Lower bound of the freshness, set by the plugin.
+    """
+    ttl = freshness(headers)
+    if ttl is None:
+        cache.delete(key)
+        return
+    cache.put(key, value, max(ttl, min_ttl))
+
+
+def conditional_headers(value: dict) -> dict[str, str]:
+    """Headers to revalidate a cached response with."""
+    ret = {}
+    if value['etag'] is not None:
+        ret['If-None-Match'] = value['etag']
+    if value['last_modified'] is not None:
+        ret['If-Modified-Since'] = value['last_modified']
+    return ret
+
+
+class CachedResponse():
+    """File-like response served from the cache; see http_helpers.Response."""
+
+    def __init__(self, value: dict):
+        """Load a cached response."""
+        self.url = value['url']
+        self.status = 200
+        self.reason = 'OK'
+        self.headers = HTTPMessage()
+        for k, v in value['headers']:
+            self.headers[k] = v
+        self._body = BytesIO(b64decode(value['body']))
+
+    def geturl(self) -> str:
+        """Return the url of the resource, after redirects."""
+        return self.url
+
+    def getcode(self) -> int:
+        """Return the HTTP status code."""
+        return self.status
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """Read up to size bytes of the body, or all of it."""
+        return self._body.read(size)
+
+    def close(self):
+        """Close the response."""
+        self._body.close()
+
+    def __enter__(self):
+        """Use as a context manager."""
+        return self
+
+    def __exit__(self, *_):
+        """Close on exit."""
+        self.close()
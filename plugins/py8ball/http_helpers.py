@@ -12,29 +12,444 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import TextIO, Optional
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
-from json import JSONDecodeError, load as json_parse
+import re
+import ssl
+import zlib
+from codecs import getincrementaldecoder, lookup as codec_lookup
+from http.client import (HTTPConnection, HTTPException, HTTPResponse,
+                         HTTPSConnection)
+from random import uniform
+from socket import socket
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Any, Callable, Iterable, Iterator, TextIO, Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import urlopen
+from json import JSONDecodeError, JSONDecoder, load as json_parse
+
+from . import circuit_breaker, deadline, http_cache
+
+
+# Redirects request() follows before giving up.
+MAX_REDIRECTS = 5
+# Seconds to wait for a connection and for each read, at most;
+# both are shortened to the time left of the plugin's deadline.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+# Times a failed request is retried; the n-th retry waits for a random
+# time of up to RETRY_BACKOFF * 2**n seconds, or for Retry-After.
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.25
+# Longest Retry-After we wait for, instead of failing.
+MAX_RETRY_WAIT = 2
+# Bytes of a redirect body we read to be able to reuse the connection.
+MAX_DRAIN = 64 * 1024
+# Content-Encodings Response decodes.
+ACCEPT_ENCODING = 'gzip, deflate'
+# Bytes request_json_stream() reads at a time.
+STREAM_CHUNK = 64 * 1024
+
+_JSON_WS = re.compile(r'[ \t\n\r]*')
+# Characters a JSON number can continue with.
+_JSON_NUMBER = frozenset('0123456789+-.eE')
+
+_TLS_CONTEXT = ssl.create_default_context()
+
+PoolKey = tuple[str, str, int]
+
+
+class ConnectionPool():
+    """
+    Per host pool of idle HTTP/1.1 keep-alive connections.
+
+    Expired connections of every host are closed whenever the pool is
+    used, and the oldest ones are closed once there are more than
+    max_total, so a long lived process contacting many hosts does not
+    accumulate sockets.
+    """
+
+    def __init__(self,
+                 max_idle: int = 4,
+                 idle_timeout: float = 30,
+                 max_total: int = 16):
+        """
+        Init state of the pool.
+
+        Args:
+            max_idle: Idle connections kept per host.
+            idle_timeout: Seconds an idle connection is kept for.
+            max_total: Idle connections kept across all hosts.
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_total = max_total
+        self._idle: dict[PoolKey, list[tuple[float, HTTPConnection]]] = {}
+        self._lock = Lock()
+
+    def get(self, key: PoolKey) -> (HTTPConnection, bool):
+        """
+        Get an idle connection for a host or a new one.
+
+        Args:
+            key: The (scheme, host, port) of the connection.
+
+        Returns:
+            The connection and True if it was reused.
+        """
+        conn = None
+        with self._lock:
+            self._sweep(monotonic())
+            idle = self._idle.get(key)
+            if idle:
+                _, conn = idle.pop()
+                if not idle:
+                    del self._idle[key]
+
+        if conn is not None:
+            return conn, True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return HTTPSConnection(host, port, context=_TLS_CONTEXT), False
+        else:
+            return HTTPConnection(host, port), False
+
+    def put(self, key: PoolKey, conn: HTTPConnection):
+        """
+        Return a connection, whose response was fully read, to the pool.
+
+        Args:
+            key: The (scheme, host, port) of the connection.
+            conn: The connection.
+        """
+        with self._lock:
+            now = monotonic()
+            idle = self._idle.setdefault(key, [])
+            idle.append((now, conn))
+            while len(idle) > self.max_idle:
+                _, old = idle.pop(0)
+                old.close()
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        """
+        Close expired connections and the oldest ones over max_total.
+
+        Must be called with the lock held.
+
+        Args:
+            now: The current monotonic() time.
+        """
+        for key in list(self._idle):
+            idle = self._idle[key]
+            while idle and now - idle[0][0] >= self.idle_timeout:
+                _, old = idle.pop(0)
+                old.close()
+            if not idle:
+                del self._idle[key]
+
+        total = sum(len(idle) for idle in self._idle.values())
+        while total > self.max_total:
+            # every list is oldest first, so the oldest is a first entry.
+            key = min(self._idle, key=lambda k: self._idle[k][0][0])
+            _, old = self._idle[key].pop(0)
+            old.close()
+            if not self._idle[key]:
+                del self._idle[key]
+            total -= 1
+
+
+POOL = ConnectionPool()
+
+
+class Response():
+    """
+    File-like response from request().
+
+    Mostly compatible with the urllib response objects request() used to
+    return. The connection is returned to the pool when the response is
+    closed after being read fully, otherwise it is closed.
+    gzip and deflate bodies are decoded as they are read, so read(size)
+    returns up to size bytes of the decoded body.
+    Every read is bounded by READ_TIMEOUT and the current deadline.
+    """
+
+    def __init__(self,
+                 url: str,
+                 res: HTTPResponse,
+                 conn: HTTPConnection,
+                 key: PoolKey,
+                 sock: socket):
+        """Wrap a response."""
+        self.url = url
+        self.status = res.status
+        self.reason = res.reason
+        self.headers = res.headers
+        self._res = res
+        self._conn = conn
+        self._key = key
+        self._sock = sock
+        self._eof = False
+        self._encoding = res.headers.get('Content-Encoding', '').lower()
+        if self._encoding in ('gzip', 'x-gzip', 'deflate'):
+            # detects both zlib and gzip headers.
+            self._decoder = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            self._decoded = False
+        else:
+            self._decoder = None
+        # see tee()
+        self._on_body: Optional[Callable[[bytes], None]] = None
+        self._body: list[bytes] = []
+        self._body_len = 0
+
+    def tee(self, on_body: Callable[[bytes], None], max_size: int):
+        """
+        Collect the body as it is read.
+
+        Args:
+            on_body: Called with the whole body once it has been read.
+            max_size: Stop collecting bodies larger than this.
+        """
+        self._on_body = on_body
+        self._max_body = max_size
+
+    def _collect(self, data: bytes):
+        if self._on_body is None:
+            return
+        self._body.append(data)
+        self._body_len += len(data)
+        if self._body_len > self._max_body:
+            self._on_body = None
+            self._body = []
+        elif self._eof:
+            on_body, self._on_body = self._on_body, None
+            on_body(b''.join(self._body))
+            self._body = []
+
+    def geturl(self) -> str:
+        """Return the url of the resource, after redirects."""
+        return self.url
+
+    def getcode(self) -> int:
+        """Return the HTTP status code."""
+        return self.status
+
+    def _read_raw(self, size: int) -> bytes:
+        if size < 0:
+            return b''.join(iter(lambda: self._read_raw(MAX_DRAIN), b''))
+        self._sock.settimeout(deadline.timeout(READ_TIMEOUT))
+        return self._res.read(size)
+
+    def _decompress(self, data: bytes, size: int = 0) -> bytes:
+        try:
+            ret = self._decoder.decompress(data, size)
+        except zlib.error as e:
+            # some servers send deflate without the zlib header.
+            if self._encoding != 'deflate' or self._decoded:
+                raise URLError(f'Bad {self._encoding} body: {e}')
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._encoding = 'raw deflate'
+            return self._decompress(data, size)
+        self._decoded = True
+        return ret
+
+    def _decode(self, size: int) -> bytes:
+        if size < 0:
+            data = self._decompress(self._decoder.unconsumed_tail
+                                    + self._read_raw(-1))
+            self._eof = True
+            return data + self._decoder.flush()
+
+        data = b''
+        while not data and not self._eof:
+            raw = self._decoder.unconsumed_tail
+            if not raw:
+                raw = self._read_raw(size)
+            if not raw:
+                self._eof = True
+                return self._decoder.flush()
+            data = self._decompress(raw, size)
+        return data
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """Read up to size bytes of the body, or all of it."""
+        if size is None:
+            size = -1
+        if self._eof:
+            return b''
+        elif self._decoder is not None:
+            data = self._decode(size)
+        else:
+            data = self._read_raw(size)
+            self._eof = self._res.isclosed()
+        self._collect(data)
+        return data
+
+    def close(self):
+        """Close the response, pooling its connection if possible."""
+        if self._conn is None:
+            return
+        if self._res.isclosed() and not self._res.will_close:
+            POOL.put(self._key, self._conn)
+        else:
+            self._res.close()
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        """Use as a context manager."""
+        return self
+
+    def __exit__(self, *_):
+        """Close on exit."""
+        self.close()
+
+
+def _send(url: str, headers: dict[str, str]) -> Response:
+    """
+    GET a url using a pooled connection.
+
+    A reused connection the server has closed in the meantime is retried
+    once on a new connection.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise URLError(f'unknown url type: {url}')
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port)
+    path = parts.path or '/'
+    if parts.query:
+        path += f'?{parts.query}'
+
+    while True:
+        conn, reused = POOL.get(key)
+        try:
+            conn.timeout = deadline.timeout(CONNECT_TIMEOUT)
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            conn.request('GET', path, headers=headers)
+            # the connection drops its socket if the server closes it.
+            sock = conn.sock
+            sock.settimeout(deadline.timeout(READ_TIMEOUT))
+            return Response(url, conn.getresponse(), conn, key, sock)
+        except (HTTPException, OSError) as e:
+            conn.close()
+            deadline.check()
+            if not reused:
+                raise URLError(e)
+
+
+def _get(url: str, headers: dict[str, str]) -> Response:
+    """GET a url, following redirects."""
+    for _ in range(MAX_REDIRECTS + 1):
+        res = _send(url, headers)
+        location = res.headers.get('Location')
+        if res.status in (301, 302, 303, 307, 308) and location:
+            res.read(MAX_DRAIN)
+            res.close()
+            url = urljoin(url, location)
+            continue
+
+        if res.status >= 400:
+            res.close()
+            raise HTTPError(url, res.status, res.reason, res.headers, None)
+        return res
+
+    raise HTTPError(url, res.status, 'Too many redirects.', res.headers, None)
+
+
+def _fetch(url: str, headers: dict[str, str]) -> Response:
+    """
+    GET a url, retrying failures and tracking them per host.
+
+    See circuit_breaker.CircuitBreaker.
+    """
+    host = urlsplit(url).netloc.lower()
+    breaker = circuit_breaker.get_breaker()
+    failing = breaker is not None and breaker.check(host)
+
+    for attempt in range(MAX_RETRIES + 1):
+        wait = None
+        try:
+            res = _get(url, headers)
+        except HTTPError as e:
+            if e.code != 429 and e.code < 500:
+                if failing:
+                    breaker.success(host)
+                raise
+            error = e
+            wait = circuit_breaker.retry_after(e.headers)
+        except URLError as e:
+            # only connection failures, not bad urls.
+            if not isinstance(e.reason, (HTTPException, OSError)):
+                raise
+            error = e
+        except deadline.DeadlineExceeded:
+            # our own time is up, which says nothing about the host.
+            raise
+        except TimeoutError as e:
+            error = e
+        else:
+            if failing:
+                breaker.success(host)
+            return res
+
+        delay = wait
+        if delay is None:
+            delay = uniform(0, RETRY_BACKOFF * 2**attempt)
+        try:
+            left = deadline.remaining()
+        except deadline.DeadlineExceeded:
+            break
+        if attempt == MAX_RETRIES or delay > MAX_RETRY_WAIT or \
+           (left is not None and delay >= left):
+            break
+        sleep(delay)
+
+    if breaker is not None:
+        breaker.failure(host, wait)
+    raise error
 
 
 def request(url: str,
             query: Optional[dict[str, str]] = None,
-            headers: Optional[dict[str, str]] = {}) -> TextIO:
+            headers: Optional[dict[str, str]] = {},
+            cache: bool = False,
+            min_ttl: float = 0) -> Response:
     """
     GET a url with an optional query string and custom headers.
 
+    Connections are kept alive and reused for later requests to the
+    same host; see ConnectionPool.
+    Redirects are followed.
+    Compression is requested and decoded transparently.
+    Connection failures, 429 and 5xx responses are retried with backoff,
+    and hosts that keep failing are not contacted for a while;
+    see circuit_breaker.CircuitBreaker.
+
+    With cache set, responses are stored in a shared on-disk cache
+    (see .http_cache), honoring Cache-Control and Expires.
+    Fresh responses are served without a request and stale ones are
+    revalidated with If-None-Match/If-Modified-Since.
+    Only bodies which are read completely are stored.
+
     Args:
         url: The URL to the resource.
         query: A dict that is urlencoded as a query string.
         headers: A dict of additional headers to pass.
+        cache: Use the response cache.
+        min_ttl: With cache, keep responses fresh for at least this many
+                 seconds, regardless of what the server says.
 
     Returns:
-        A TextIO-like file (in fact a urllib response object).
+        A TextIO-like file (see Response).
 
     Raises:
         urllib.error.URLError on protocol issues. (DNS failure).
         urllib.error.HTTPError on issues like 403 forbidden.
+        circuit_breaker.ServiceUnavailable (an URLError) if the host is down.
+        TimeoutError if the server is too slow or the deadline passed.
     """
     param_string = f'?{urlencode(query)}' if query is not None else ''
     req = f'{url}{param_string}'
@@ -44,14 +459,41 @@ def request(url: str,
               'adedomin/neo8ball-irc',
               'Accept-Language': 'en-US,en;q=0.5',
               'Accept': 'text/html,application/xhtml+xml',
+              'Accept-Encoding': ACCEPT_ENCODING,
               **headers}
-    return urlopen(Request(req,
-                           headers=header))
+
+    store = http_cache.get_cache() if cache else None
+    cache_key = f'{header["Accept"]} {req}'
+    entry = None
+    if store is not None:
+        entry = store.get_entry(cache_key)
+        if entry is not None:
+            value, expires = entry
+            if expires >= time():
+                return http_cache.CachedResponse(value)
+            header.update(http_cache.conditional_headers(value))
+
+    res = _fetch(req, header)
+    if store is None:
+        return res
+
+    if res.status == 304 and entry is not None:
+        res.read()
+        res.close()
+        http_cache.refresh(store, cache_key, value, res.headers, min_ttl)
+        return http_cache.CachedResponse(value)
+
+    res.tee(lambda body: http_cache.store(store, cache_key, res.url,
+                                          res.headers, body, min_ttl),
+            http_cache.MAX_BODY)
+    return res
 
 
 def request_json(url: str,
                  query: Optional[dict[str, str]] = None,
-                 headers: Optional[dict[str, str]] = {}) -> dict:
+                 headers: Optional[dict[str, str]] = {},
+                 cache: bool = False,
+                 min_ttl: float = 0) -> dict:
     """
     GET and parse a JSON object.
 
@@ -59,6 +501,8 @@ def request_json(url: str,
         url: The URL to the resource.
         query: A dict that is urlencoded as a query string.
         headers: A dict of additional headers to pass.
+        cache: Use the response cache; see request().
+        min_ttl: Minimum freshness of cached responses; see request().
 
     Returns:
         Dict of the parsed json request.
@@ -68,26 +512,139 @@ def request_json(url: str,
     """
     header = {'Accept': 'application/json',
               **headers}
-    with request(url, query, header) as res:
+    with request(url, query, header, cache, min_ttl) as res:
         return json_parse(res)
 
 
+def request_json_stream(url: str,
+                        query: Optional[dict[str, str]] = None,
+                        headers: Optional[dict[str, str]] = {},
+                        fields: Optional[Iterable[str]] = None
+                        ) -> Iterator[Any]:
+    """
+    GET a JSON array and parse its elements one at a time.
+
+    Unlike request_json(), only the element being parsed is held in memory,
+    so large arrays can be processed with bounded memory.
+
+    Args:
+        url: The URL to the resource.
+        query: A dict that is urlencoded as a query string.
+        headers: A dict of additional headers to pass.
+        fields: If given, object elements only keep these keys.
+
+    Returns:
+        Iterator of the elements of the array.
+
+    Raises:
+        json.JSONDecodeError if invalid json response or not an array.
+    """
+    header = {'Accept': 'application/json',
+              **headers}
+    fields = list(fields) if fields is not None else None
+    decoder = JSONDecoder()
+    text = getincrementaldecoder('utf8')()
+    buf = ''
+    idx = 0
+    eof = False
+
+    with request(url, query, header) as res:
+        def fill():
+            nonlocal buf, idx, eof
+            data = res.read(STREAM_CHUNK)
+            eof = not data
+            buf = buf[idx:] + text.decode(data, final=eof)
+            idx = 0
+
+        def skip_ws() -> str:
+            nonlocal idx
+            while True:
+                idx = _JSON_WS.match(buf, idx).end()
+                if idx < len(buf) or eof:
+                    return buf[idx:idx + 1]
+                fill()
+
+        if skip_ws() != '[':
+            raise JSONDecodeError('Expecting array', buf, idx)
+        idx += 1
+        if skip_ws() == ']':
+            return
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, idx)
+                # a number could continue past the end of the buffer,
+                # e.g. `1.` of `1.5`, which leaves `.` after the value.
+                if not eof and (end == len(buf) or buf[end] in _JSON_NUMBER):
+                    raise JSONDecodeError('Truncated', buf, end)
+            except JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            idx = end
+
+            if fields is not None and isinstance(value, dict):
+                value = {k: value[k] for k in fields if k in value}
+            yield value
+
+            c = skip_ws()
+            if c == ']':
+                return
+            elif c != ',':
+                raise JSONDecodeError("Expecting ',' delimiter", buf, idx)
+            idx += 1
+            skip_ws()
+
+
+def get_charset(headers, default: Optional[str] = 'utf8') -> Optional[str]:
+    """
+    Get the charset of a response from its Content-Type.
+
+    Args:
+        headers: The response headers.
+        default: Charset to use if there is none, or it is unknown.
+
+    Returns:
+        The name of a codec python supports.
+    """
+    charset = headers.get_content_charset() if headers is not None else None
+    if charset is None:
+        return default
+    try:
+        return codec_lookup(charset).name
+    except LookupError:
+        return default
+
+
 def chunk_read(f: TextIO,
                size: int = 4096,
-               times: int = 16) -> str:
+               times: int = 16,
+               encoding: str = 'utf8') -> Iterator[str]:
     """
     Chunk a file-like object into consumable bites.
 
+    The chunks are decoded incrementally, so characters split between
+    chunks are not lost. An empty string is yielded at the end of the file.
+
     Args:
         f: TextIO-like file that can be chunked.
         size: how many bytes to read per iteration (default 4096).
         times: number of times to read chunks (default 16).
+        encoding: charset of the file (default utf8); see get_charset().
 
     Returns:
-        utf8 encoded strings (errors ignored).
+        decoded strings (errors ignored).
     """
+    decoder = getincrementaldecoder(encoding)('ignore')
     for i in range(times):
-        yield f.read(size).decode('utf8', 'ignore')
+        deadline.check()
+        data = f.read(size)
+        text = decoder.decode(data, final=not data)
+        if text or not data:
+            yield text
+        if not data:
+            return
 
 
 def paste_service(f: TextIO) -> str:
@@ -107,7 +664,8 @@ def paste_service(f: TextIO) -> str:
     """
     try:
         res = urlopen(url='https://images.ghetty.space/paste',
-                      data=f)
+                      data=f,
+                      timeout=deadline.timeout(READ_TIMEOUT))
         ret = json_parse(res)
         if ret.get('status', '') != 'ok':
             raise ValueError(ret.get('message', 'Unknown error.'))
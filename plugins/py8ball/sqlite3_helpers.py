@@ -13,9 +13,10 @@
 # limitations under the License.
 
 import sqlite3
+from contextlib import contextmanager
 from functools import wraps
 from pathlib import Path
-from typing import Union, Callable
+from typing import Union, Callable, Iterator
 
 
 def escape_fts5(query: str) -> str:
@@ -40,10 +41,24 @@ class Sqlite3Manager():
 
     def __init__(self,
                  dbpath: Union[str, Path] = ':memory:',
-                 kwarg: str = 'db'):
-        """Init state of manager."""
+                 kwarg: str = 'db',
+                 read_only: bool = False,
+                 timeout: float = 5.0):
+        """
+        Init state of manager.
+
+        Args:
+            dbpath: Path to the database.
+            kwarg: The keyword argument apply() passes the database as.
+            read_only: Open an existing database read-only, for databases
+                       which are built once and replaced atomically.
+            timeout: Seconds to wait for a lock held by another process
+                     before failing with `database is locked`.
+        """
         self.dbpath = dbpath
         self.kwarg = kwarg
+        self.read_only = read_only
+        self.timeout = timeout
 
     def apply(self, func: Callable) -> Callable:
         """
@@ -67,13 +82,36 @@ class Sqlite3Manager():
         """
         @wraps(func)
         def wrap(*args, **kwargs):
-            db = sqlite3.connect(self.dbpath)
-            db.execute("pragma journal_mode=wal")
-            kwargs[self.kwarg] = db
-            try:
-                with db:
-                    retval = func(*args, **kwargs)
-            finally:
-                db.close()
-            return retval
+            with self.connect() as db:
+                kwargs[self.kwarg] = db
+                return func(*args, **kwargs)
         return wrap
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open the database for the duration of a with block.
+
+        The block is run in a transaction which is committed on success.
+        Blocks which read before they write should start it with
+        `BEGIN IMMEDIATE`, so concurrent writers wait for each other
+        instead of failing.
+
+        Example:
+            with my_manager_instance.connect() as db:
+                db.execute("SELECT y FROM x LIMIT 1;")
+
+        Raises:
+             sqlite3.Error on any sqlite specific error condition.
+        """
+        if self.read_only:
+            uri = f'{Path(self.dbpath).resolve().as_uri()}?mode=ro'
+            db = sqlite3.connect(uri, uri=True, timeout=self.timeout)
+        else:
+            db = sqlite3.connect(self.dbpath, timeout=self.timeout)
+            db.execute("pragma journal_mode=wal")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
@@ -30,7 +30,10 @@ from py8ball.http_helpers import paste_service
 USAGE = (':r {}usage: .{} {{ '
          'add nick quotable text | '
          'get nick [num] | '
-         'search nick message. }}')
+         'search nick message [page]. }}')
+
+# Quotes on each page of search results.
+SEARCH_PAGE_SIZE = 25
 
 
 try:
@@ -40,16 +43,41 @@ except KeyError:
     log_e('$PERSIST_LOC or $XDG_DATA_HOME are not defined.')
     exit(1)
 
+# Schema version, kept in PRAGMA user_version; see setup_db().
+QUOTE_DB_VERSION = 2
+
 
 @QUOTE_DB.apply
 def setup_db(*, db: sqlite3.Connection):
     """
-    Set up the Table schema for the quotes.py plugin.
+    Set up or migrate the Table schema for the quotes.py plugin.
+
+    Databases made before versioning are at version 0.
 
     Args:
         db: the database to setup.
     """
+    if db.execute('PRAGMA user_version;').fetchone()[0] >= QUOTE_DB_VERSION:
+        return
+
     cur = db.cursor()
+    # one process migrates, the others wait and find it done.
+    cur.execute('BEGIN IMMEDIATE;')
+    version = cur.execute('PRAGMA user_version;').fetchone()[0]
+    if version < 1:
+        migrate_v1(cur)
+    if version < 2:
+        migrate_v2(cur)
+    cur.execute(f'PRAGMA user_version = {QUOTE_DB_VERSION};')
+
+
+def migrate_v1(cur: sqlite3.Cursor):
+    """
+    Create the base schema and the per nick quote id counters.
+
+    Args:
+        cur: Database cursor, in a write transaction.
+    """
     cur.execute("""
     CREATE TABLE IF NOT EXISTS irc_quotes (
         qid  INTEGER NOT NULL,
@@ -78,12 +106,80 @@ def setup_db(*, db: sqlite3.Connection):
         DELETE FROM irc_quotes_search WHERE row = OLD.rowid;
     END;
     """)
+    # the last quote id given to each nick.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS irc_quotes_counter (
+        nick     TEXT PRIMARY KEY NOT NULL,
+        last_qid INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("""
+    INSERT INTO irc_quotes_counter (nick, last_qid)
+    SELECT nick, max(qid) FROM irc_quotes GROUP BY nick
+    ON CONFLICT (nick) DO UPDATE SET last_qid = excluded.last_qid;
+    """)
+
+
+def migrate_v2(cur: sqlite3.Cursor):
+    """
+    Index quotes by nick and keep a count and max quote id per nick.
+
+    Args:
+        cur: Database cursor, in a write transaction.
+    """
+    cur.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS irc_quotesIdxNick
+    ON irc_quotes (nick, qid);
+    """)
+    cur.execute("""
+    ALTER TABLE irc_quotes_counter
+    ADD COLUMN quotes INTEGER NOT NULL DEFAULT 0;
+    """)
+    cur.execute("""
+    ALTER TABLE irc_quotes_counter
+    ADD COLUMN max_qid INTEGER NOT NULL DEFAULT 0;
+    """)
+    cur.execute("""
+    INSERT INTO irc_quotes_counter (nick, last_qid, quotes, max_qid)
+    SELECT nick, max(qid), count(*), max(qid) FROM irc_quotes
+    GROUP BY nick
+    ON CONFLICT (nick) DO UPDATE SET
+        last_qid = max(last_qid, excluded.last_qid),
+        quotes = excluded.quotes,
+        max_qid = excluded.max_qid;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS irc_quotes_ins_counter
+    AFTER INSERT ON irc_quotes
+    BEGIN
+        INSERT INTO irc_quotes_counter (nick, last_qid, quotes, max_qid)
+        VALUES (NEW.nick, NEW.qid, 1, NEW.qid)
+        ON CONFLICT (nick) DO UPDATE SET
+            last_qid = max(last_qid, NEW.qid),
+            quotes = quotes + 1,
+            max_qid = max(max_qid, NEW.qid);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS irc_quotes_del_counter
+    AFTER DELETE ON irc_quotes
+    BEGIN
+        UPDATE irc_quotes_counter SET
+            quotes = quotes - 1,
+            max_qid = coalesce((
+                SELECT max(qid) FROM irc_quotes WHERE nick = OLD.nick
+            ), 0)
+        WHERE nick = OLD.nick;
+    END;
+    """)
 
 
 def get_max_qid(cur: sqlite3.Cursor, nick: str) -> int:
     """
     Return the maximum quote id for a given nickname.
 
+    Read from the per nick summary, which the irc_quotes triggers maintain.
+
     Args:
         cur: Database cursor.
         nick: The nickname to lookup.
@@ -95,13 +191,13 @@ def get_max_qid(cur: sqlite3.Cursor, nick: str) -> int:
         KeyError if no quotes exist for a given nickname.
     """
     stmt = cur.execute("""
-    SELECT max(qid) FROM irc_quotes WHERE nick = ?;
+    SELECT max_qid FROM irc_quotes_counter WHERE nick = ? AND quotes > 0;
     """, (nick.lower(),))
-    qid = stmt.fetchone()[0]
-    if qid is None:
+    row = stmt.fetchone()
+    if row is None:
         raise KeyError(f'No quotes for {nick}.')
     else:
-        return qid
+        return row[0]
 
 
 @QUOTE_DB.apply
@@ -110,6 +206,10 @@ def add_quote(nick: str, message: str, *,
     """
     Add a quote to a given nickname.
 
+    The quote id is taken from the counter of the nick, in the same
+    transaction as the insert; the transaction is started IMMEDIATE so
+    concurrent adds wait on each other instead of colliding.
+
     Args:
         nick: The nickname associated with the quote.
         message: The quote.
@@ -119,11 +219,16 @@ def add_quote(nick: str, message: str, *,
         the quote id that was added.
     """
     cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE;')
 
-    try:
-        next_id = get_max_qid(cur, nick) + 1
-    except KeyError:
-        next_id = 1
+    cur.execute("""
+    INSERT INTO irc_quotes_counter (nick, last_qid) VALUES (?, 1)
+    ON CONFLICT (nick) DO UPDATE SET last_qid = last_qid + 1;
+    """, (nick.lower(),))
+    # no RETURNING, which needs sqlite 3.35.
+    next_id = cur.execute("""
+    SELECT last_qid FROM irc_quotes_counter WHERE nick = ?;
+    """, (nick.lower(),)).fetchone()[0]
 
     cur.execute("""
     INSERT INTO irc_quotes (qid, nick, mesg) VALUES (?, ?, ?);
@@ -132,18 +237,23 @@ def add_quote(nick: str, message: str, *,
 
 
 @QUOTE_DB.apply
-def search_quotes(nick: str, mesg: str, *,
-                  db: sqlite3.Connection) -> list[str]:
+def search_quotes(nick: str, mesg: str, page: int = 1, *,
+                  db: sqlite3.Connection) -> tuple[list[str], int]:
     """
     Search for a given quote for a given nickname.
 
+    The nick is part of the full-text query, so only the quotes of the
+    nick are matched and ranked; bm25 ranks them by the message alone.
+
     Args:
         nick: The nickname to search against.
         mesg: A query used to find a quote.
+        page: The page of results, SEARCH_PAGE_SIZE quotes each.
         db: The Database.
 
     Returns:
-        A list of all matching Quotes (MAX: 25 quotes).
+        The matching Quotes on the page, best first,
+        and the number of matching quotes.
 
     Raises:
         KeyError if a given user does not have quotes.
@@ -153,20 +263,40 @@ def search_quotes(nick: str, mesg: str, *,
     # Raises KeyError.
     max_id = get_max_qid(cur, nick)
 
+    query = f'mesg : ({escape_fts5(mesg)})'
+    # nicks like `_` have no tokens to match, only the exact check below.
+    if re.search('[a-zA-Z0-9]', nick):
+        query = f'nick : {escape_fts5(nick.lower())} AND {query}'
     result = []
+    total = 0
+    # columns are (row, nick, mesg); only mesg counts towards the rank.
     stmt = cur.execute("""
-    SELECT qid, mesg FROM irc_quotes
+    SELECT qid, mesg, total FROM irc_quotes
     INNER JOIN (
-        SELECT row FROM irc_quotes_search
-        WHERE irc_quotes_search MATCH ? AND nick = ?
-        ORDER BY RANK
+        SELECT row, score, count(*) OVER () AS total
+        FROM (
+            SELECT row, bm25(irc_quotes_search, 0.0, 0.0, 1.0) AS score
+            FROM irc_quotes_search
+            WHERE irc_quotes_search MATCH ? AND nick = ?
+        )
+        ORDER BY score, row
+        LIMIT ? OFFSET ?
     )
     ON irc_quotes.rowid = row
-    LIMIT 25;
-    """, ('mesg : '+escape_fts5(mesg), nick.lower()))
-    for qid, mesg in stmt:
+    ORDER BY score, row;
+    """, (query,
+          nick.lower(),
+          SEARCH_PAGE_SIZE,
+          (page - 1) * SEARCH_PAGE_SIZE))
+    for qid, mesg, total in stmt:
         result.append(f'[{qid}/{max_id}] <{nick}> {mesg}')
-    return result
+    if not result and page > 1:
+        # past the last page; still say how many results there are.
+        total = cur.execute("""
+        SELECT count(*) FROM irc_quotes_search
+        WHERE irc_quotes_search MATCH ? AND nick = ?;
+        """, (query, nick.lower())).fetchone()[0]
+    return result, total
 
 
 @QUOTE_DB.apply
@@ -244,6 +374,31 @@ def parse_query(q: str) -> list:
     return cmd, nick, rest
 
 
+def parse_search(arg: str) -> tuple[str, int]:
+    """
+    Split the page number, if any, off the end of a search.
+
+    Args:
+        arg: The search, e.g. `some words 2`.
+
+    Returns:
+        The query and the page.
+
+    Raises:
+        ValueError if the page is not positive.
+    """
+    query, _, page = arg.rpartition(' ')
+    if query.strip() == '' or not page.isdigit():
+        return arg, 1
+    try:
+        page = guard_large_int(page, min_size=1)
+    except OverflowError:
+        raise ValueError('Page number is too large')
+    if page < 1:
+        raise ValueError('Pages start at 1')
+    return query.rstrip(), page
+
+
 def handle_command(cmd: str, nick: str,
                    arg: Union[str, int]) -> str:
     """
@@ -258,7 +413,8 @@ def handle_command(cmd: str, nick: str,
         arg: the argument associated with the command.
              get: a quote id to lookup.
              add: the quote to add to the database.
-             search: words/phrase used to find quotes.
+             search: words/phrase used to find quotes,
+                     optionally followed by a page number.
 
     Returns:
         A string to output to IRC.
@@ -275,18 +431,28 @@ def handle_command(cmd: str, nick: str,
         qid = add_quote(nick, arg)
         return f'Added quote #{qid} to {nick}.'
     elif cmd == 'search':
+        query, page = parse_search(arg)
         try:
-            res = search_quotes(nick, arg)
+            res, total = search_quotes(nick, query, page)
         except KeyError as e:
             return e.args[0]
 
-        if len(res) == 0:
+        pages = -(-total // SEARCH_PAGE_SIZE)
+        if total == 0:
             return 'No Results.'
+        elif len(res) == 0:
+            return f'No page {page}; results end at page {pages}.'
         elif len(res) == 1:
             return res[0]
-        else:
+        try:
             url = paste_service(StringIO('\n'.join(res)))
-            return f':r Results: {url}'
+        except Exception as e:
+            log_e(str(e))
+            return res[0]
+        if pages > 1:
+            return f'Results (page {page}/{pages}): {url}'
+        else:
+            return f'Results: {url}'
 
 
 @main_decorator
@@ -316,7 +482,14 @@ def main(*,
         try:
             out = handle_command(cmd, nick, arg)
         except ValueError as e:
-            out = USAGE.format(f'{e}: ', command)
+            print(USAGE.format(f'{e}: ', command))
+            return 0
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            print(':r The quote database is busy; try again later.')
+            log_e(str(e))
+            return 1
 
         print(f':r {out}')
 
@@ -14,9 +14,13 @@
 # limitations under the License.
 
 from py8ball import main_decorator
+from py8ball.cache import Cache
+from py8ball.environment import get_persistant_location, get_temp_location
 from py8ball.http_helpers import request_json
 from py8ball.logging import log_e, log_d
 
+import re
+
 from os import environ
 from urllib.parse import parse_qsl
 from urllib.error import HTTPError
@@ -25,25 +29,88 @@ from json import JSONDecodeError, load as json_load
 
 YT_STATS = 'https://www.googleapis.com/youtube/v3/videos'
 YT_SEARCH = 'https://www.googleapis.com/youtube/v3/search'
+# Videos of a single message that are looked up.
+MAX_VIDEOS = 5
+VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+
+try:
+    CACHE_DIR = get_persistant_location()
+except KeyError:
+    CACHE_DIR = get_temp_location()
+YT_CACHE = Cache(CACHE_DIR / 'youtube-cache.db',
+                 max_entries=4096,
+                 max_bytes=4 * 1024 * 1024)
+# Seconds search results, and video stats, are cached for.
+SEARCH_TTL = 7 * 24 * 60 * 60
+STATS_TTL = 30 * 60
+# Parts of a video resource fmt_video() uses, which are all that is cached.
+VIDEO_FIELDS = {
+    'snippet': ('title', 'channelTitle', 'publishedAt'),
+    'contentDetails': ('duration',),
+    'statistics': ('likeCount', 'dislikeCount', 'viewCount'),
+}
 
 
 def get_search(q: str, key: str) -> str:
     """Get a Youtube Video ID for a given search query"""
-    res = request_json(YT_SEARCH,
-                       query={'part': 'snippet',
-                              'type': 'video',
-                              'maxResults': '1',
-                              'q': q, 'key': key})
-    return res['items'][0]['id']['videoId']
+    def search():
+        res = request_json(YT_SEARCH,
+                           query={'part': 'snippet',
+                                  'type': 'video',
+                                  'maxResults': '1',
+                                  'q': q, 'key': key})
+        return res['items'][0]['id']['videoId']
+
+    return YT_CACHE.fetch(f'search:{" ".join(q.lower().split())}',
+                          search, SEARCH_TTL)
+
+
+def get_stats(ids: list[str], key: str, has_url: bool) -> list[str]:
+    """
+    Get the YT stats of videos, fetching uncached ones in one call.
 
+    Cached stats are used as is; the rest come from one API request, so a
+    message with several links costs a single call.
 
-def get_stats(ids: str, key: str, has_url: bool) -> str:
-    """Get The YT stats for a given video as a string"""
-    res = request_json(YT_STATS,
-                       query={'part': 'snippet,statistics,contentDetails',
-                              'id': ids, 'key': key})
-    video = res['items'][0]
+    Args:
+        ids: The video IDs.
+        key: The API key.
+        has_url: If the user already has the links of the videos.
+
+    Returns:
+        The stats of every video that exists, in the order of ids.
 
+    Raises:
+        IndexError if none of the videos exist.
+    """
+    def fetch(missing: list[str]) -> dict[str, dict]:
+        res = request_json(YT_STATS,
+                           query={'part': 'snippet,statistics,contentDetails',
+                                  'id': ','.join(k.removeprefix('video:')
+                                                 for k in missing),
+                                  'key': key})
+        return {f'video:{video["id"]}': trim_video(video)
+                for video in res['items']}
+
+    videos = YT_CACHE.fetch_many([f'video:{vid}' for vid in ids],
+                                 fetch, STATS_TTL)
+    if not videos:
+        raise IndexError('No videos found.')
+    return [fmt_video(videos[k], has_url)
+            for k in (f'video:{vid}' for vid in ids) if k in videos]
+
+
+def trim_video(video: dict) -> dict:
+    """Keep only the VIDEO_FIELDS of a video resource."""
+    ret = {'id': video['id']}
+    for part, fields in VIDEO_FIELDS.items():
+        ret[part] = {k: v for k, v in video.get(part, {}).items()
+                     if k in fields}
+    return ret
+
+
+def fmt_video(video: dict, has_url: bool) -> str:
+    """Format the stats of a video for IRC."""
     retval = (f'\x02{video["snippet"]["title"]}\x02 '
               f'{video["contentDetails"]["duration"][2:].lower()} - ')
     if not has_url:
@@ -73,31 +140,37 @@ def indexOf(s: str, substr: str) -> int:
         return -1
 
 
-def find_id(url: str) -> list[str]:
+def find_ids(message: str) -> list[str]:
     """
-    Find an ID from a regexp matched URL.
+    Find the video IDs of all the youtube links in a message.
 
     Args:
-        url: the youtube URL
+        message: the message with youtube links.
 
     Returns:
-        matched video id.
+        Up to MAX_VIDEOS unique video ids, in the order of the message.
 
     Raises:
-        ValueError if no such video ID could be found.
+        ValueError if no video ID could be found.
     """
-    urls = url.split(' ')
-    for u in urls:
+    ids = {}
+    for u in message.split(' '):
+        vid = ''
         if (idx := indexOf(u, 'youtu.be/')) != -1:
             # 9 = length of youtu.be/
-            return u[idx+9:]
+            vid = u[idx+9:]
         elif (idx := indexOf(u, 'youtube.com/watch?')) != -1:
             # 18 = length of youtube.com/watch?
             new_u = u[idx+18:]
             for k, v in parse_qsl(new_u):
                 if k == 'v':
-                    return v
-    raise ValueError('Could not find a valid Video ID.')
+                    vid = v
+                    break
+        if (m := VIDEO_ID.match(vid)) is not None:
+            ids[m.group()] = None
+    if not ids:
+        raise ValueError('Could not find a valid Video ID.')
+    return list(ids)[:MAX_VIDEOS]
 
 
 @main_decorator
@@ -122,7 +195,7 @@ def main(*,
     elif match != '':
         has_url = True
         try:
-            ids = find_id(message)
+            ids = find_ids(message)
         except ValueError:
             log_d(f'Failed to detect an ID from the message: {message}')
             return 0
@@ -131,9 +204,9 @@ def main(*,
 
     try:
         if not has_url:
-            ids = get_search(message, yt_api_key)
-        stats = get_stats(ids, yt_api_key, has_url)
-        print(f':r {stats}')
+            ids = [get_search(message, yt_api_key)]
+        for stats in get_stats(ids, yt_api_key, has_url):
+            print(f':r {stats}')
     except HTTPError as e:
         print(':r Could not get video details, API Error.')
         log_e(f'Youtube API Key may be invalid: {e}')
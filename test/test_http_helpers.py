@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021  Anthony DeDominic <adedomin@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parent / '..' / 'plugins'))
+
+from py8ball import http_helpers  # noqa: E402
+
+
+class SplitResponse():
+    """Response which returns its body in the given pieces."""
+
+    def __init__(self, pieces: list[bytes]):
+        """Serve pieces, one per read."""
+        self.pieces = list(pieces)
+
+    def read(self, size: int = -1) -> bytes:
+        """Return the next piece, ignoring size."""
+        return self.pieces.pop(0) if self.pieces else b''
+
+    def __enter__(self):
+        """Use as a context manager."""
+        return self
+
+    def __exit__(self, *_):
+        """Nothing to close."""
+
+
+class TestRequestJsonStream(unittest.TestCase):
+    """request_json_stream() must not depend on where reads end."""
+
+    DOCS = [
+        '[1.5, 2.25]',
+        '[1e5]',
+        '[-12.5E-3, 0, 10]',
+        ' [ {"id": "a", "n": 1.25}, "café", true, null, [1, 2] ] ',
+        '[]',
+    ]
+
+    def stream(self, pieces: list[bytes]) -> list:
+        with mock.patch.object(http_helpers, 'request',
+                               return_value=SplitResponse(pieces)):
+            return list(http_helpers.request_json_stream('http://x/'))
+
+    def test_every_split(self):
+        for doc in self.DOCS:
+            data = doc.encode('utf8')
+            # an empty read is the end of the body, so both are non-empty.
+            for i in range(1, len(data)):
+                with self.subTest(doc=doc, split=i):
+                    self.assertEqual(self.stream([data[:i], data[i:]]),
+                                     json.loads(doc))
+
+    def test_byte_at_a_time(self):
+        for doc in self.DOCS:
+            data = doc.encode('utf8')
+            with self.subTest(doc=doc):
+                pieces = [data[i:i + 1] for i in range(len(data))]
+                self.assertEqual(self.stream(pieces), json.loads(doc))
+
+    def test_invalid(self):
+        for doc in ('[1.]', '[1 2]', '{"a": 1}'):
+            with self.subTest(doc=doc):
+                with self.assertRaises(json.JSONDecodeError):
+                    self.stream([doc.encode('utf8')])
+
+
+if __name__ == '__main__':
+    unittest.main()